@@ -1,6 +1,15 @@
 import services.logger
 import services.login
 import services.live
+from services.http_client import http_client
+from services.post_processor import post_processor
 import asyncio
 
-asyncio.get_event_loop().run_forever()
+loop = asyncio.get_event_loop()
+try:
+    loop.run_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    post_processor.shutdown()
+    loop.run_until_complete(http_client.close())
@@ -0,0 +1,97 @@
+# 弹幕流命令分发基准测试：对比逐条解析 JSON 后再判断 cmd 与先读命令名再按订阅分发的单房间吞吐量
+# 用法: python -m benchmarks.command_router [批次数量]
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+import zlib
+
+from services.command_router import CommandRouter
+from services.message_stream import ProtocolVersion, decode_commands, iter_packets
+
+# 繁忙直播间中常见命令的大致比例，只有 DANMU_MSG、LIVE、PREPARING 被订阅
+COMMAND_WEIGHTS = {
+    'DANMU_MSG': 30,
+    'INTERACT_WORD': 35,
+    'SEND_GIFT': 15,
+    'ONLINE_RANK_COUNT': 8,
+    'ENTRY_EFFECT': 6,
+    'STOP_LIVE_ROOM_LIST': 4,
+    'WATCHED_CHANGE': 2,
+}
+BATCH_SIZE = 50
+
+
+def make_command(cmd: str, index: int) -> dict:
+    if cmd == 'DANMU_MSG':
+        return {'cmd': cmd, 'info': [[0, 1, 25, 16777215, 1660000000000 + index, 0, 0, '', 0, 0, 0, '', 0, '{}', '{}'],
+                                     f'测试弹幕 {index}', [123456 + index % 1000, 'user', 0, 0, 0, 10000, 1, '']]}
+    return {'cmd': cmd, 'data': {'uid': 123456 + index, 'uname': f'用户{index}', 'num': 1, 'giftName': '小心心',
+                                 'timestamp': 1660000000 + index, 'medal_info': {'medal_name': '测试', 'level': 10}}}
+
+
+def make_packet(body: bytes, version: int) -> bytes:
+    return struct.pack('>IHHII', 16 + len(body), 16, version, 5, 0) + body
+
+
+def make_messages(count: int) -> list[bytes]:
+    rng = random.Random(0)
+    names = list(COMMAND_WEIGHTS)
+    weights = list(COMMAND_WEIGHTS.values())
+    messages = []
+    for batch in range(count):
+        cmds = rng.choices(names, weights, k=BATCH_SIZE)
+        packed = b''.join(
+            make_packet(json.dumps(make_command(cmd, batch * BATCH_SIZE + i), ensure_ascii=False,
+                                   separators=(',', ':')).encode('utf-8'), ProtocolVersion.JSON)
+            for i, cmd in enumerate(cmds))
+        messages.append(make_packet(zlib.compress(packed), ProtocolVersion.ZLIB))
+    return messages
+
+
+async def run_full_parse(messages: list[bytes], handled: set):
+    # 修改前的方式：解析每条命令的 JSON 后再比较 cmd
+    handled_count = 0
+    for message in messages:
+        for _, _, body in iter_packets(message):
+            for _, _, packet in iter_packets(zlib.decompress(body)):
+                command = json.loads(bytes(packet))
+                if command['cmd'] in handled:
+                    handled_count += 1
+    return handled_count
+
+
+async def run_router(messages: list[bytes], router: CommandRouter):
+    for message in messages:
+        for version, _, body in iter_packets(message):
+            for command in await decode_commands(version, body, router):
+                await router.dispatch(command)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    messages = make_messages(count)
+    total = count * BATCH_SIZE
+    received = 0
+
+    def on_command(command: dict):
+        nonlocal received
+        received += 1
+
+    router = CommandRouter()
+    for cmd in ('DANMU_MSG', 'LIVE', 'PREPARING'):
+        router.subscribe(cmd, on_command)
+
+    for name, coroutine in (('解析全部 JSON', run_full_parse(messages, {'DANMU_MSG', 'LIVE', 'PREPARING'})),
+                            ('CommandRouter', run_router(messages, router))):
+        start = time.perf_counter()
+        asyncio.run(coroutine)
+        elapsed = time.perf_counter() - start
+        print(f'{name:<20}{total / elapsed:>14,.0f} 条命令/秒')
+    print(f'订阅的命令: {received} / {total}')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,10 +12,19 @@ class Config(BaseModel):
                 CUSTOM = 2
 
             download_type: DownloadType = DownloadType.DEFAULT
+            # DEFAULT 时使用的内置录制方式: ffmpeg / native
+            downloader: str = 'ffmpeg'
+            # CUSTOM 时使用的录制插件，格式为 module:ClassName
             custom_downloader: Optional[str] = None
         download_format: str = '%title-%Y年%m月%d日-%H点%M分场'
 
         download: DownloadConfig = DownloadConfig()
+        # 弹幕过滤规则，接收弹幕时即丢弃匹配的弹幕；不含正则特殊字符的规则按关键词匹配，其余按正则匹配
+        danmu_filters: list[str] = []
+        # 弹幕过滤规则文件，每行一条规则
+        danmu_filter_file: Optional[str] = None
+        # 是否以 DEBUG 级别记录礼物、进场、房间变更等命令，关闭时这些命令读出命令名后即被丢弃
+        log_room_commands: bool = False
 
     class MonitorLiveRoom(BaseModel):
         class Quality(IntEnum):
@@ -39,6 +48,12 @@ class Config(BaseModel):
         auto_download_quality: Quality = Quality.SUPER
         auto_upload: AutoUpload = AutoUpload()
         transcode: bool = False
+        # 录制结束后额外导出 B 站格式的 xml 弹幕文件
+        save_danmu_xml: bool = False
+        # 除视频原始分辨率外额外生成的弹幕尺寸，如 ["1920x1080", "1280x720"]
+        extra_ass_sizes: list[str] = []
+        # 单独为该直播间指定录制方式，为 None 时使用 live_config.download 的设置
+        downloader: Optional[str] = None
     mid: int = 0
     SESSDATA: Optional[str]
     bili_jct: Optional[str]
@@ -1,9 +1,21 @@
 import os
+import asyncio
 import subprocess
+import threading
+from collections import deque
 from pathlib import Path
-import shutil
+from typing import Optional
 from loguru import logger
-import ffmpeg
+from services.flv import concat_flv
+from services.post_processor import post_processor
+
+
+def render_danmaku(video_path: Path, ass_path: Path):
+    try:
+        run_ffmpeg(['-i', str(video_path.absolute()), '-vf', f'ass={ass_path.absolute()}', '-vcodec', 'libx264',
+                    '-acodec', 'copy', str(video_path.with_suffix('.danmaku.flv').absolute())])
+    except RuntimeError as e:
+        raise RuntimeError(f'渲染弹幕出错：{e}')
 
 
 @logger.catch
@@ -14,51 +26,79 @@ async def render_ass(video_path: Path):
     if not ass_path.exists():
         raise FileNotFoundError(f'弹幕文件不存在：{ass_path}')
     await fix_video(video_path)
-    p = subprocess.Popen(f'ffmpeg -i "{video_path.absolute()}" -vf ass="{ass_path.absolute()}" -vcodec libx264 -acodec copy "{video_path.with_suffix(".danmaku.flv").absolute()}"',
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    stdout, stderr = p.communicate()
-    if p.returncode != 0:
-        raise RuntimeError(f'渲染弹幕出错：{stderr.decode("utf-8")}')
-    return stdout, stderr
+    await post_processor.submit(post_processor.Priority.RENDER, f'渲染弹幕 {video_path.name}',
+                                render_danmaku, video_path, ass_path)
 
 
-@logger.catch
-async def fix_video(video_path: Path, transcode=False):
-    if not video_path.exists():
-        raise FileNotFoundError(f'视频文件不存在：{video_path}')
-    # p = subprocess.Popen(f'ffmpeg -y -i "{video_path.absolute()}" -codec copy "{video_path.with_suffix(".temp.flv").absolute()}"',
-    #                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    # stdout, stderr = p.communicate()
-    # if p.returncode != 0:
-    #     raise RuntimeError(f'修复视频文件出错：{stderr.decode("utf-8")}')
-    # else:
-    #     os.remove(video_path)
-    #     shutil.copy(video_path.with_suffix('.temp.flv').absolute(), video_path.absolute())
-    #     os.remove(video_path.with_suffix('.temp.flv').absolute())
-    #
-    # return stdout, stderr
-    input_video = ffmpeg.input(video_path.absolute())
-    out = ffmpeg.output(input_video, filename=video_path.with_suffix('.temp.flv').absolute(), vcodec='copy',
-                        acodec='copy')
+def run_ffmpeg(args: list[str], feed=None):
+    # 运行 ffmpeg，feed 用于向 stdin 写入输入数据；stderr 只保留最后若干行用于报错
+    process = subprocess.Popen(['ffmpeg', '-y', '-nostats', '-loglevel', 'warning', *args],
+                               stdin=subprocess.PIPE if feed else subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr_lines = deque(maxlen=50)
+    reader = threading.Thread(
+        target=lambda: stderr_lines.extend(line.decode('utf-8', 'replace').rstrip() for line in process.stderr),
+        daemon=True
+    )
+    reader.start()
     try:
-        out.run()
-    except ffmpeg.Error as e:
-        raise RuntimeError(f'修复视频文件出错：{e.stderr.decode("utf-8")}')
-    os.remove(video_path)
-    shutil.copy(video_path.with_suffix('.temp.flv').absolute(), video_path.absolute())
-    os.remove(video_path.with_suffix('.temp.flv').absolute())
+        if feed:
+            try:
+                feed(process.stdin)
+            except BrokenPipeError:
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+        process.wait()
+    finally:
+        # feed 出错时 ffmpeg 可能仍在运行
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        reader.join()
+    if process.returncode != 0:
+        raise RuntimeError('\n'.join(stderr_lines))
+
+
+def finalize_video(video_path: Path, transcode=False, input_files: Optional[list[Path]] = None):
+    # 一次写入完成合并分段、重封装(可选转码)与关键帧索引，最后原子替换目标文件
+    if input_files is None:
+        input_files = [video_path]
+    for input_file in input_files:
+        if not input_file.exists():
+            raise FileNotFoundError(f'视频文件不存在：{input_file}')
+    temp_path = video_path.with_suffix('.temp.flv')
+    feed = None
+    if len(input_files) == 1:
+        args = ['-i', str(input_files[0].absolute())]
+    else:
+        args = ['-f', 'flv', '-i', 'pipe:0']
+
+        def feed(stdin):
+            concat_flv(input_files, stdin)
     if transcode:
-        out = ffmpeg.output(input_video, filename=video_path.with_suffix('.temp.flv').absolute(), vcodec='h264', acodec='aac')
-        try:
-            out.run()
-            os.remove(video_path)
-            shutil.copy(video_path.with_suffix('.temp.flv').absolute(), video_path.absolute())
-            os.remove(video_path.with_suffix('.temp.flv').absolute())
-        except ffmpeg.Error as e:
-            raise RuntimeError(f'修复视频文件出错：{e.stderr.decode("utf-8")}')
+        args += ['-c:v', 'h264', '-c:a', 'aac']
+    else:
+        args += ['-c', 'copy']
+    args += ['-flvflags', 'add_keyframe_index', '-f', 'flv', str(temp_path.absolute())]
+    try:
+        run_ffmpeg(args, feed)
+        os.replace(temp_path, video_path)
+    except RuntimeError as e:
+        raise RuntimeError(f'修复视频文件出错：{e}')
+    finally:
+        # 任何失败都不留下临时文件，成功时临时文件已被替换
+        if temp_path.exists():
+            os.remove(temp_path)
+
+
+async def fix_video(video_path: Path, transcode=False, input_files: Optional[list[Path]] = None):
+    await post_processor.submit(post_processor.Priority.REMUX, f'修复视频 {video_path.name}',
+                                finalize_video, video_path, transcode, input_files)
 
 
 if __name__ == '__main__':
-    import asyncio
     loop = asyncio.get_event_loop().run_until_complete(fix_video(Path(input('请输入视频文件路径：')), transcode=True))
 
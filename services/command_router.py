@@ -0,0 +1,42 @@
+import inspect
+from typing import Awaitable, Callable, Optional, Union
+
+from loguru import logger
+
+CommandHandler = Callable[[dict], Union[None, Awaitable[None]]]
+
+
+class CommandRouter:
+    # 按 cmd 将弹幕流命令分发给订阅者，没有订阅者的命令在读出命令名后即被丢弃，不解析 JSON
+
+    def __init__(self):
+        self.handlers: dict[str, list[CommandHandler]] = {}
+
+    def __contains__(self, cmd: str) -> bool:
+        # 作为 decode_commands 的命令过滤集合使用
+        return cmd in self.handlers
+
+    def subscribe(self, cmd: str, handler: CommandHandler):
+        # handler 可以是普通函数或协程函数
+        self.handlers.setdefault(cmd, []).append(handler)
+
+    def unsubscribe(self, cmd: str, handler: CommandHandler):
+        handlers = self.handlers.get(cmd)
+        if handlers is None or handler not in handlers:
+            return
+        handlers.remove(handler)
+        if not handlers:
+            del self.handlers[cmd]
+
+    async def dispatch(self, command: dict):
+        handlers: Optional[list[CommandHandler]] = self.handlers.get(command.get('cmd'))
+        if handlers is None:
+            return
+        for handler in handlers:
+            try:
+                result = handler(command)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                # 单个订阅者出错不影响其他订阅者和后续命令
+                logger.debug(f'处理命令 {command["cmd"]} 失败: {e}')
@@ -0,0 +1,111 @@
+import re
+from typing import Iterable, Optional
+
+from loguru import logger
+
+
+class KeywordAutomaton:
+    # Aho-Corasick 自动机：一次扫描文本即可判断是否包含任意关键词，耗时与关键词数量无关
+
+    def __init__(self, keywords: Iterable[str]):
+        # goto[state] 为该状态的转移表，fail[state] 为失配时回退的状态，output[state] 表示到达该状态时已匹配到关键词
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[bool] = [False]
+        for keyword in keywords:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+            state = next_state
+        self.output[state] = True
+
+    def build(self):
+        # 按层次遍历计算失配指针，并把后缀上的匹配结果合并到当前状态
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                fail_state = self.fail[state]
+                while fail_state and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+                self.output[next_state] = self.output[next_state] or self.output[self.fail[next_state]]
+                queue.append(next_state)
+
+    def search(self, text: str) -> bool:
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                return True
+        return False
+
+
+class CommentFilter:
+    # 弹幕过滤：不含正则特殊字符的规则作为关键词放入自动机；不含分组与行内全局标志的正则合并为一个表达式，
+    # 其余正则(分组、反向引用、(?i) 等)单独匹配，保证与逐条匹配的结果一致
+    regex_special_chars = frozenset('.^$*+?{}[]\\|()')
+    global_flags_regex = re.compile(r'\(\?[aiLmsux]+\)')
+
+    def __init__(self, rules: Iterable[str] = (), strict: bool = False):
+        # strict 为 True 时无效的正则抛出 ValueError，否则记录错误并跳过该规则
+        keywords = []
+        patterns = []
+        self.separate_regexes: list[re.Pattern] = []
+        for rule in rules:
+            if not rule:
+                continue
+            if self.regex_special_chars.isdisjoint(rule):
+                keywords.append(rule)
+                continue
+            try:
+                regex = re.compile(rule)
+            except re.error as e:
+                if strict:
+                    raise ValueError(f'无效的正则表达式: {rule}')
+                logger.error(f'忽略无效的弹幕过滤规则 {rule}: {e}')
+                continue
+            if regex.groups or self.global_flags_regex.search(rule):
+                self.separate_regexes.append(regex)
+            else:
+                patterns.append(rule)
+        self.keywords = KeywordAutomaton(keywords) if keywords else None
+        self.regex = None
+        if patterns:
+            try:
+                self.regex = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+            except re.error:
+                # 无法合并时全部单独匹配
+                self.separate_regexes.extend(re.compile(pattern) for pattern in patterns)
+
+    def __bool__(self):
+        return self.keywords is not None or self.regex is not None or bool(self.separate_regexes)
+
+    def search(self, text: str) -> bool:
+        # 返回弹幕是否应被过滤
+        if self.keywords is not None and self.keywords.search(text):
+            return True
+        if self.regex is not None and self.regex.search(text) is not None:
+            return True
+        return any(regex.search(text) is not None for regex in self.separate_regexes)
+
+    @classmethod
+    def load(cls, rules: Iterable[str] = (), rules_file: Optional[str] = None, strict: bool = False) -> 'CommentFilter':
+        # rules_file 每行一条规则
+        rules = list(rules)
+        if rules_file:
+            with open(rules_file, 'r', encoding='utf-8') as f:
+                rules.extend(line.strip() for line in f)
+        return cls(rules, strict)
@@ -1,21 +1,31 @@
 import requests
 
 import argparse
+import bisect
 import calendar
 import gettext
-import io
+import glob
+import heapq
+import itertools
 import json
 import logging
 import math
+import operator
 import os
 import random
 import re
 import sys
 import time
 import xml.dom.minidom
+import xml.etree.ElementTree
 import ffmpeg
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
 from pathlib import Path
 from loguru import logger
+from services.util import write_danmu_xml
+from services.danmu_journal import DanmuJournal
+from services.comment_filter import CommentFilter
 
 if sys.version_info < (3,):
     raise RuntimeError('at least Python 3.0 is required')
@@ -168,51 +178,82 @@ def ReadCommentsAcfun(f, fontsize):
             continue
 
 
+def IterElements(f, tag, chunk_size=1024 * 1024):
+    # 分块读取并增量解析 xml，逐个返回已解析完成的 tag 元素，处理后即从树中移除，内存占用与文件大小无关
+    parser = xml.etree.ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+    while True:
+        chunk = f.read(chunk_size)
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.close()
+        for event, element in parser.read_events():
+            if root is None:
+                root = element
+            elif event == 'end' and element.tag == tag:
+                yield element
+                root.clear()
+        if not chunk:
+            break
+
+
 def ReadCommentsBilibili(f, fontsize):
-    dom = xml.dom.minidom.parse(f)
-    comment_element = dom.getElementsByTagName('d')
-    for i, comment in enumerate(comment_element):
+    for i, comment in enumerate(IterElements(f, 'd')):
         try:
-            p = str(comment.getAttribute('p')).split(',')
+            p = str(comment.get('p')).split(',')
             assert len(p) >= 5
             assert p[1] in ('1', '4', '5', '6', '7', '8')
-            if comment.childNodes.length > 0:
+            if comment.text:
                 if p[1] in ('1', '4', '5', '6'):
-                    c = str(comment.childNodes[0].wholeText).replace('/n', '\n')
+                    c = str(comment.text).replace('/n', '\n')
                     size = int(p[2]) * fontsize / 25.0
                     yield (float(p[0]), int(p[4]), i, c, {'1': 0, '4': 2, '5': 1, '6': 3}[p[1]], int(p[3]), size, (c.count('\n') + 1) * size, CalculateLength(c) * size)
                 elif p[1] == '7':  # positioned comment
-                    c = str(comment.childNodes[0].wholeText)
+                    c = str(comment.text)
                     yield (float(p[0]), int(p[4]), i, c, 'bilipos', int(p[3]), int(p[2]), 0, 0)
                 elif p[1] == '8':
                     pass  # ignore scripted comment
         except (AssertionError, AttributeError, IndexError, TypeError, ValueError):
-            logging.warning(_('Invalid comment: %s') % comment.toxml())
+            logging.warning(_('Invalid comment: %s') % xml.etree.ElementTree.tostring(comment, encoding='unicode'))
             continue
 
 
 def ReadCommentsBilibili2(f, fontsize):
-    dom = xml.dom.minidom.parse(f)
-    comment_element = dom.getElementsByTagName('d')
-    for i, comment in enumerate(comment_element):
+    for i, comment in enumerate(IterElements(f, 'd')):
         try:
-            p = str(comment.getAttribute('p')).split(',')
+            p = str(comment.get('p')).split(',')
             assert len(p) >= 7
             assert p[3] in ('1', '4', '5', '6', '7', '8')
-            if comment.childNodes.length > 0:
+            if comment.text:
                 time = float(p[2]) / 1000.0
                 if p[3] in ('1', '4', '5', '6'):
-                    c = str(comment.childNodes[0].wholeText).replace('/n', '\n')
+                    c = str(comment.text).replace('/n', '\n')
                     size = int(p[4]) * fontsize / 25.0
                     yield (time, int(p[6]), i, c, {'1': 0, '4': 2, '5': 1, '6': 3}[p[3]], int(p[5]), size, (c.count('\n') + 1) * size, CalculateLength(c) * size)
                 elif p[3] == '7':  # positioned comment
-                    c = str(comment.childNodes[0].wholeText)
+                    c = str(comment.text)
                     yield (time, int(p[6]), i, c, 'bilipos', int(p[5]), int(p[4]), 0, 0)
                 elif p[3] == '8':
                     pass  # ignore scripted comment
         except (AssertionError, AttributeError, IndexError, TypeError, ValueError):
-            logging.warning(_('Invalid comment: %s') % comment.toxml())
+            logging.warning(_('Invalid comment: %s') % xml.etree.ElementTree.tostring(comment, encoding='unicode'))
+            continue
+
+
+def ReadCommentsDanmu(danmus, fontsize, start_index=0):
+    # 直接读取录制时保存的弹幕记录，结果与先导出 xml 再由 ReadCommentsBilibili 读取相同
+    for i, danmu in enumerate(danmus, start_index):
+        if not danmu.content:
             continue
+        timeline = round(danmu.appear_time, 5)
+        timestamp = int(danmu.send_time / 1000)
+        if danmu.danmu_type in (1, 4, 5, 6):
+            c = danmu.content.replace('/n', '\n')
+            size = danmu.font_size * fontsize / 25.0
+            yield (timeline, timestamp, i, c, {1: 0, 4: 2, 5: 1, 6: 3}[danmu.danmu_type], danmu.color, size, (c.count('\n') + 1) * size, CalculateLength(c) * size)
+        elif danmu.danmu_type == 7:  # positioned comment
+            yield (timeline, timestamp, i, danmu.content, 'bilipos', danmu.color, danmu.font_size, 0, 0)
 
 
 def ReadCommentsTudou(f, fontsize):
@@ -534,91 +575,145 @@ def ConvertFlashRotation(rotY, rotZ, X, Y, width, height):
 
 
 def ProcessComments(comments, f, width, height, bottomReserved, fontface, fontsize, alpha, duration_marquee, duration_still, filters_regex, reduced, progress_callback):
-    styleid = 'Danmaku2ASS_%04x' % random.randint(0, 0xffff)
-    WriteASSHead(f, width, height, fontface, fontsize, alpha, styleid)
-    rows = [[None] * (height - bottomReserved + 1) for i in range(4)]
-    for idx, i in enumerate(comments):
-        if progress_callback and idx % 1000 == 0:
-            progress_callback(idx, len(comments))
-        if isinstance(i[4], int):
-            skip = False
-            for filter_regex in filters_regex:
-                if filter_regex and filter_regex.search(i[3]):
-                    skip = True
-                    break
-            if skip:
-                continue
-            row = 0
-            rowmax = height - bottomReserved - i[7]
-            while row <= rowmax:
-                freerows = TestFreeRows(rows, i, row, width, height, bottomReserved, duration_marquee, duration_still)
-                if freerows >= i[7]:
+    layout = CommentLayout(f, width, height, bottomReserved, fontface, fontsize, alpha, duration_marquee, duration_still, filters_regex, reduced)
+    layout.write_head()
+    return layout.process(comments, progress_callback)
+
+
+class CommentLayout:
+    # 保存各类弹幕的占用行，可以分多批处理按时间排序的弹幕，并追加写入同一个 ass 文件
+
+    def __init__(self, f, width, height, bottomReserved, fontface, fontsize, alpha, duration_marquee, duration_still, filters_regex, reduced):
+        self.f = f
+        self.width = width
+        self.height = height
+        self.bottomReserved = bottomReserved
+        self.fontface = fontface
+        self.fontsize = fontsize
+        self.alpha = alpha
+        self.duration_marquee = duration_marquee
+        self.duration_still = duration_still
+        if not isinstance(filters_regex, CommentFilter):
+            filters_regex = CommentFilter(filter_regex.pattern for filter_regex in filters_regex if filter_regex)
+        self.filters_regex = filters_regex
+        self.reduced = reduced
+        self.styleid = 'Danmaku2ASS_%04x' % random.randint(0, 0xffff)
+        self.rows = [CommentRows(height - bottomReserved + 1) for i in range(4)]
+
+    def write_head(self):
+        WriteASSHead(self.f, self.width, self.height, self.fontface, self.fontsize, self.alpha, self.styleid)
+
+    def process(self, comments, progress_callback=None):
+        f, rows, styleid = self.f, self.rows, self.styleid
+        width, height, bottomReserved, fontsize = self.width, self.height, self.bottomReserved, self.fontsize
+        duration_marquee, duration_still = self.duration_marquee, self.duration_still
+        # comments 可以是生成器，此时总数未知
+        total = len(comments) if hasattr(comments, '__len__') else None
+        count = 0
+        for idx, i in enumerate(comments):
+            count += 1
+            if progress_callback and idx % 1000 == 0:
+                progress_callback(idx, total)
+            if isinstance(i[4], int):
+                if self.filters_regex and self.filters_regex.search(i[3]):
+                    continue
+                row = FindFreeRow(rows, i, width, height, bottomReserved, duration_marquee, duration_still)
+                if row is not None:
                     MarkCommentRow(rows, i, row)
                     WriteComment(f, i, row, width, height, bottomReserved, fontsize, duration_marquee, duration_still, styleid)
-                    break
                 else:
-                    row += freerows or 1
+                    if not self.reduced:
+                        row = FindAlternativeRow(rows, i, height, bottomReserved)
+                        MarkCommentRow(rows, i, row)
+                        WriteComment(f, i, row, width, height, bottomReserved, fontsize, duration_marquee, duration_still, styleid)
+            elif i[4] == 'bilipos':
+                WriteCommentBilibiliPositioned(f, i, width, height, styleid)
+            elif i[4] == 'acfunpos':
+                WriteCommentAcfunPositioned(f, i, width, height, styleid)
             else:
-                if not reduced:
-                    row = FindAlternativeRow(rows, i, height, bottomReserved)
-                    MarkCommentRow(rows, i, row)
-                    WriteComment(f, i, row, width, height, bottomReserved, fontsize, duration_marquee, duration_still, styleid)
-        elif i[4] == 'bilipos':
-            WriteCommentBilibiliPositioned(f, i, width, height, styleid)
-        elif i[4] == 'acfunpos':
-            WriteCommentAcfunPositioned(f, i, width, height, styleid)
-        else:
-            logging.warning(_('Invalid comment: %r') % i[3])
-    if progress_callback:
-        progress_callback(len(comments), len(comments))
+                logging.warning(_('Invalid comment: %r') % i[3])
+        if progress_callback:
+            progress_callback(count, count)
+        return count
+
+
+class CommentRows:
+    # 同一类弹幕在纵向上的占用情况，以按起始行排序、互不重叠的 [start, end, comment] 区间保存，
+    # 与逐行记录占用弹幕的数组等价，查找与标记的开销只与区间数量有关，与舞台高度无关
+
+    def __init__(self, size):
+        self.size = size
+        self.starts = []
+        self.intervals = []
+
+    def mark(self, start, end, c):
+        end = min(end, self.size)
+        if start >= end:
+            return
+        starts, intervals = self.starts, self.intervals
+        i = bisect.bisect_right(starts, start) - 1
+        if i < 0 or intervals[i][1] <= start:
+            i += 1
+        j = bisect.bisect_left(starts, end)
+        replacement = []
+        if i < j and intervals[i][0] < start:
+            replacement.append([intervals[i][0], start, intervals[i][2]])
+        replacement.append([start, end, c])
+        if i < j and intervals[j - 1][1] > end:
+            replacement.append([end, intervals[j - 1][1], intervals[j - 1][2]])
+        intervals[i:j] = replacement
+        starts[i:j] = [interval[0] for interval in replacement]
+
+
+def IsRowBlocked(target, c, width, duration_marquee, duration_still):
+    if c[4] in (1, 2):
+        return target[0] + duration_still > c[0]
+    try:
+        thresholdTime = c[0] - duration_marquee * (1 - width / (c[8] + width))
+    except ZeroDivisionError:
+        thresholdTime = c[0] - duration_marquee
+    try:
+        return target[0] > thresholdTime or target[0] + target[8] * duration_marquee / (target[8] + width) > c[0]
+    except ZeroDivisionError:
+        return False
 
 
-def TestFreeRows(rows, c, row, width, height, bottomReserved, duration_marquee, duration_still):
-    res = 0
-    rowmax = height - bottomReserved
-    targetRow = None
-    if c[4] in (1, 2):
-        while row < rowmax and res < c[7]:
-            if targetRow != rows[c[4]][row]:
-                targetRow = rows[c[4]][row]
-                if targetRow and targetRow[0] + duration_still > c[0]:
-                    break
-            row += 1
-            res += 1
-    else:
-        try:
-            thresholdTime = c[0] - duration_marquee * (1 - width / (c[8] + width))
-        except ZeroDivisionError:
-            thresholdTime = c[0] - duration_marquee
-        while row < rowmax and res < c[7]:
-            if targetRow != rows[c[4]][row]:
-                targetRow = rows[c[4]][row]
-                try:
-                    if targetRow and (targetRow[0] > thresholdTime or targetRow[0] + targetRow[8] * duration_marquee / (targetRow[8] + width) > c[0]):
-                        break
-                except ZeroDivisionError:
-                    pass
-            row += 1
-            res += 1
-    return res
+def FindFreeRow(rows, c, width, height, bottomReserved, duration_marquee, duration_still):
+    # 返回能完整放下弹幕的最小行号，放不下时返回 None
+    rowmax = height - bottomReserved - c[7]
+    commentHeight = math.ceil(c[7])
+    row = 0
+    for start, end, target in rows[c[4]].intervals:
+        if row > rowmax:
+            return None
+        if start >= row + commentHeight:
+            break
+        if end > row and IsRowBlocked(target, c, width, duration_marquee, duration_still):
+            row = end
+    return row if row <= rowmax else None
 
 
 def FindAlternativeRow(rows, c, height, bottomReserved):
+    # 没有空闲位置时，选择最早出现的弹幕所在的行
+    rowmax = height - bottomReserved - math.ceil(c[7])
     res = 0
-    for row in range(height - bottomReserved - math.ceil(c[7])):
-        if not rows[c[4]][row]:
+    resTime = None
+    row = 0
+    for start, end, target in rows[c[4]].intervals:
+        if row >= rowmax:
+            break
+        if start > row:
             return row
-        elif rows[c[4]][row][0] < rows[c[4]][res][0]:
-            res = row
+        if resTime is None or target[0] < resTime:
+            res, resTime = start, target[0]
+        row = end
+    if row < rowmax:
+        return row
     return res
 
 
 def MarkCommentRow(rows, c, row):
-    try:
-        for i in range(row, row + math.ceil(c[7])):
-            rows[c[4]][i] = c
-    except IndexError:
-        pass
+    rows[c[4]].mark(row, row + math.ceil(c[7]), c)
 
 
 def WriteASSHead(f, width, height, fontface, fontsize, alpha, styleid):
@@ -727,10 +822,15 @@ def ConvertToFile(filename_or_file, *args, **kwargs):
         return filename_or_file
 
 
-def FilterBadChars(f):
-    s = f.read()
-    s = re.sub('[\\x00-\\x08\\x0b\\x0c\\x0e-\\x1f]', '\ufffd', s)
-    return io.StringIO(s)
+class FilterBadChars:
+    # 读取时逐块替换 xml 不允许的控制字符，不复制整个文件
+    bad_chars_regex = re.compile('[\\x00-\\x08\\x0b\\x0c\\x0e-\\x1f]')
+
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        return self.bad_chars_regex.sub('\ufffd', self.f.read(size))
 
 
 class safe_list(list):
@@ -751,20 +851,14 @@ def export(func):
     return func
 
 
+def CompileCommentFilters(comment_filter=None, comment_filters_file=None):
+    # 所有规则编译为一个 CommentFilter，每条弹幕只需检查一次
+    return CommentFilter.load([comment_filter] if comment_filter else [], comment_filters_file, strict=True)
+
+
 @export
 def Danmaku2ASS(input_files, input_format, output_file, stage_width, stage_height, reserve_blank=0, font_face=_('(FONT) sans-serif')[7:], font_size=25.0, text_opacity=1.0, duration_marquee=5.0, duration_still=5.0, comment_filter=None, comment_filters_file=None, is_reduce_comments=False, progress_callback=None):
-    comment_filters = [comment_filter]
-    if comment_filters_file:
-        with open(comment_filters_file, 'r') as f:
-            d = f.readlines()
-            comment_filters.extend([i.strip() for i in d])
-    filters_regex = []
-    for comment_filter in comment_filters:
-        try:
-            if comment_filter:
-                filters_regex.append(re.compile(comment_filter))
-        except:
-            raise ValueError(_('Invalid regular expression: %s') % comment_filter)
+    filters_regex = CompileCommentFilters(comment_filter, comment_filters_file)
     fo = None
     comments = ReadComments(input_files, input_format, font_size)
     try:
@@ -778,23 +872,98 @@ def Danmaku2ASS(input_files, input_format, output_file, stage_width, stage_heigh
             fo.close()
 
 
+# 同时输出多个尺寸时，先按该字号读取弹幕，再换算到各尺寸的字号
+BASE_FONT_SIZE = 25.0
+
+
+class StageProfile(NamedTuple):
+    # 一份输出：文件、舞台尺寸与默认字号
+    output_file: str
+    stage_width: int
+    stage_height: int
+    font_size: float
+
+
+@export
+def Danmaku2ASSMulti(input_files, input_format, profiles, reserve_blank=0, font_face=_('(FONT) sans-serif')[7:], text_opacity=1.0, duration_marquee=5.0, duration_still=5.0, comment_filter=None, comment_filters_file=None, is_reduce_comments=False, max_workers=None):
+    # 只读取、排序一次弹幕，按 profiles 中的每个舞台尺寸与字号分别输出
+    filters_regex = CompileCommentFilters(comment_filter, comment_filters_file)
+    comments = ReadComments(input_files, input_format, BASE_FONT_SIZE)
+    return LayoutStageProfiles(comments, profiles, reserve_blank, font_face, text_opacity, duration_marquee, duration_still, filters_regex, is_reduce_comments, max_workers)
+
+
+def RescaleComments(comments, font_size, base_font_size=BASE_FONT_SIZE):
+    # 将按 base_font_size 读取的弹幕换算为另一字号，逐条生成
+    if font_size == base_font_size:
+        yield from comments
+        return
+    for c in comments:
+        if isinstance(c[4], int):
+            size = c[6] * font_size / base_font_size
+            yield c[:6] + (size, (c[3].count('\n') + 1) * size, CalculateLength(c[3]) * size)
+        elif c[4] == 'acfunpos':
+            yield c[:6] + (c[6] * font_size / base_font_size,) + c[7:]
+        else:
+            yield c
+
+
+def LayoutStageProfile(comments, profile, reserve_blank, font_face, text_opacity, duration_marquee, duration_still, filters_regex, is_reduce_comments):
+    comments = RescaleComments(comments, profile.font_size)
+    with ConvertToFile(profile.output_file, 'w', encoding='utf-8-sig', errors='replace', newline='\r\n') as fo:
+        return ProcessComments(comments, fo, profile.stage_width, profile.stage_height, reserve_blank, font_face, profile.font_size, text_opacity, duration_marquee, duration_still, filters_regex, is_reduce_comments, None)
+
+
+def LayoutStageProfiles(comments, profiles, reserve_blank, font_face, text_opacity, duration_marquee, duration_still, filters_regex, is_reduce_comments, max_workers=None):
+    # 各尺寸的布局互不依赖，多于一份输出时在多个进程中并行，返回弹幕数量
+    # 只有一份输出时 comments 可以是生成器，不必在内存中保存全部弹幕
+    args = (reserve_blank, font_face, text_opacity, duration_marquee, duration_still, filters_regex, is_reduce_comments)
+    if len(profiles) == 1:
+        return LayoutStageProfile(comments, profiles[0], *args)
+    comments = list(comments)
+    if max_workers == 1:
+        for profile in profiles:
+            LayoutStageProfile(comments, profile, *args)
+        return len(comments)
+    with ProcessPoolExecutor(min(len(profiles), max_workers or os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(LayoutStageProfile, comments, profile, *args) for profile in profiles]
+        for future in futures:
+            future.result()
+    return len(comments)
+
+
+# 弹幕按 (时间, 序号) 排序，不比较内容与颜色
+CommentSortKey = operator.itemgetter(0, 2)
+
+
+def ReorderComments(comments, window=60.0):
+    # 对基本有序的弹幕(如按接收顺序记录的弹幕日志)做有界重排：只缓存最近 window 秒内的弹幕，
+    # 早于已输出弹幕超过 window 秒的迟到弹幕直接输出，内存占用与总弹幕数无关
+    pending = []
+    for c in comments:
+        heapq.heappush(pending, (CommentSortKey(c), c))
+        while pending and c[0] - pending[0][0][0] > window:
+            yield heapq.heappop(pending)[1]
+    while pending:
+        yield heapq.heappop(pending)[1]
+
+
 @export
 def ReadComments(input_files, input_format, font_size=25.0, progress_callback=None):
+    # 返回按时间排序的弹幕生成器：每个文件单独排序(已排序的文件直接流式读取)，多个文件再用堆归并
     if isinstance(input_files, bytes):
         input_files = str(bytes(input_files).decode('utf-8', 'replace'))
     if isinstance(input_files, str):
         input_files = [input_files]
     else:
         input_files = list(input_files)
-    comments = []
+    sources = []
     for idx, i in enumerate(input_files):
         if progress_callback:
             progress_callback(idx, len(input_files))
-        with ConvertToFile(i, 'r', encoding='utf-8', errors='replace') as f:
-            s = f.read()
-            str_io = io.StringIO(s)
+        f = ConvertToFile(i, 'r', encoding='utf-8', errors='replace')
+        try:
             if input_format == 'autodetect':
-                CommentProcessor = GetCommentProcessor(str_io)
+                CommentProcessor = GetCommentProcessor(f)
                 if not CommentProcessor:
                     raise ValueError(
                         _('Failed to detect comment file format: %s') % i
@@ -805,11 +974,54 @@ def ReadComments(input_files, input_format, font_size=25.0, progress_callback=No
                     raise ValueError(
                         _('Unknown comment file format: %s') % input_format
                     )
-            comments.extend(CommentProcessor(FilterBadChars(str_io), font_size))
+        except Exception:
+            f.close()
+            raise
+        sources.append(ReadSortedComments(f, CommentProcessor, font_size))
     if progress_callback:
         progress_callback(len(input_files), len(input_files))
-    comments.sort()
-    return comments
+    if len(sources) == 1:
+        return sources[0]
+    return heapq.merge(*sources, key=CommentSortKey)
+
+
+def ReadSortedComments(f, CommentProcessor, font_size):
+    try:
+        if CommentProcessor is ReadCommentsBilibili and f.seekable() and IsBilibiliPresorted(f):
+            f.seek(0)
+            yield from CommentProcessor(FilterBadChars(f), font_size)
+        else:
+            if f.seekable():
+                f.seek(0)
+            yield from sorted(CommentProcessor(FilterBadChars(f), font_size), key=CommentSortKey)
+    finally:
+        f.close()
+
+
+BilibiliTimelineRegex = re.compile('<d\\s+p="([^,"]*),')
+
+
+def IsBilibiliPresorted(f, chunk_size=1024 * 1024):
+    # 只用正则扫描每条弹幕的出现时间，判断文件是否已按时间排序(录制的弹幕通常如此)，不解析 xml
+    last = float('-inf')
+    tail = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return True
+        buffer = tail + chunk
+        end = 0
+        for match in BilibiliTimelineRegex.finditer(buffer):
+            end = match.end()
+            try:
+                timeline = float(match.group(1))
+            except ValueError:
+                continue
+            if timeline < last:
+                return False
+            last = timeline
+        # 保留末尾可能被截断的 <d p="...
+        tail = buffer[max(end, len(buffer) - 64):]
 
 
 @export
@@ -817,6 +1029,14 @@ def GetCommentProcessor(input_file):
     return ReadCommentsBilibili
 
 
+def ParseStageSize(size):
+    try:
+        width, height = str(size).split('x', 1)
+        return int(width), int(height)
+    except ValueError:
+        raise ValueError(_('Invalid stage size: %r') % size)
+
+
 def main1():
     logging.basicConfig(format='%(levelname)s: %(message)s')
     if len(sys.argv) == 1:
@@ -836,15 +1056,89 @@ def main1():
     parser.add_argument('-r', '--reduce', action='store_true', help=_('Reduce the amount of comments if stage is full'))
     parser.add_argument('file', metavar=_('FILE'), nargs='+', help=_('Comment file to be processed'))
     args = parser.parse_args()
-    try:
-        width, height = str(args.size).split('x', 1)
-        width = int(width)
-        height = int(height)
-    except ValueError:
-        raise ValueError(_('Invalid stage size: %r') % args.size)
+    width, height = ParseStageSize(args.size)
     Danmaku2ASS(args.file, args.format, args.output, width, height, args.protect, args.font, args.fontsize, args.alpha, args.duration_marquee, args.duration_still, args.filter, args.filter_file, args.reduce)
 
 
+def FindCommentFiles(paths):
+    # 展开目录(递归查找 *.xml)与通配符，按出现顺序去重
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '**', '*.xml'), recursive=True)))
+        else:
+            files.extend(sorted(glob.glob(path, recursive=True)))
+    return list(dict.fromkeys(files))
+
+
+def GetBatchProfiles(input_file, output_dir, stage_sizes, font_size):
+    # 只有一个尺寸时输出 name.ass，多个尺寸时输出 name.WxH.ass
+    base = os.path.splitext(os.path.basename(input_file))[0]
+    directory = output_dir or os.path.dirname(input_file)
+    profiles = []
+    for width, height in stage_sizes:
+        name = base + ('.ass' if len(stage_sizes) == 1 else '.%dx%d.ass' % (width, height))
+        profiles.append(StageProfile(os.path.join(directory, name), width, height, font_size or get_font_size(width)))
+    return profiles
+
+
+def IsUpToDate(input_file, profiles):
+    input_mtime = os.path.getmtime(input_file)
+    return all(os.path.exists(profile.output_file) and os.path.getmtime(profile.output_file) >= input_mtime for profile in profiles)
+
+
+def main_batch():
+    # 批量转换：每个进程处理一个文件，跳过比输入新的输出
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    parser = argparse.ArgumentParser(description=_('Convert danmaku archives in batch'))
+    parser.add_argument('-f', '--format', metavar=_('FORMAT'), help=_('Format of input file (autodetect|%s) [default: autodetect]') % '|'.join(i for i in CommentFormatMap), default='autodetect')
+    parser.add_argument('-o', '--output-dir', metavar=_('DIR'), help=_('Output directory [default: next to each input]'))
+    parser.add_argument('-s', '--size', metavar=_('WIDTHxHEIGHT'), action='append', required=True, help=_('Stage size in pixels, may be given several times'))
+    parser.add_argument('-fn', '--font', metavar=_('FONT'), help=_('Specify font face [default: %s]') % font, default=font)
+    parser.add_argument('-fs', '--fontsize', metavar=_('SIZE'), help=_('Default font size [default: chosen by stage width]'), type=float)
+    parser.add_argument('-a', '--alpha', metavar=_('ALPHA'), help=_('Text opacity'), type=float, default=alpha)
+    parser.add_argument('-dm', '--duration-marquee', metavar=_('SECONDS'), help=_('Duration of scrolling comment display [default: %s]') % duration_marquee, type=float, default=duration_marquee)
+    parser.add_argument('-ds', '--duration-still', metavar=_('SECONDS'), help=_('Duration of still comment display [default: %s]') % duration_still, type=float, default=duration_still)
+    parser.add_argument('-fl', '--filter', help=_('Regular expression to filter comments'))
+    parser.add_argument('-flf', '--filter-file', help=_('Regular expressions from file (one line one regex) to filter comments'))
+    parser.add_argument('-p', '--protect', metavar=_('HEIGHT'), help=_('Reserve blank on the bottom of the stage'), type=int, default=protect)
+    parser.add_argument('-r', '--reduce', action='store_true', help=_('Reduce the amount of comments if stage is full'))
+    parser.add_argument('-j', '--jobs', metavar=_('N'), help=_('Number of worker processes [default: CPU count]'), type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--force', action='store_true', help=_('Convert even if the outputs are newer than the input'))
+    parser.add_argument('path', metavar=_('PATH'), nargs='+', help=_('Comment files, directories or glob patterns'))
+    args = parser.parse_args()
+    stage_sizes = [ParseStageSize(size) for size in args.size]
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    tasks = []
+    skipped = 0
+    for input_file in FindCommentFiles(args.path):
+        profiles = GetBatchProfiles(input_file, args.output_dir, stage_sizes, args.fontsize)
+        if not args.force and IsUpToDate(input_file, profiles):
+            skipped += 1
+        else:
+            tasks.append((input_file, profiles))
+    converted = failed = comment_count = 0
+    start_time = time.time()
+    with ProcessPoolExecutor(max(args.jobs, 1)) as executor:
+        futures = {
+            executor.submit(Danmaku2ASSMulti, input_file, args.format, profiles, args.protect, args.font, args.alpha, args.duration_marquee, args.duration_still, args.filter, args.filter_file, args.reduce, 1): input_file
+            for input_file, profiles in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                comment_count += future.result()
+                converted += 1
+            except Exception as e:
+                failed += 1
+                logging.error(_('Failed to convert %s: %s') % (futures[future], e))
+            if (converted + failed) % 100 == 0:
+                print(_('%d/%d files done') % (converted + failed, len(tasks)), file=sys.stderr)
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(_('Converted %d files (%d comments) in %.1f s: %.2f files/s, %.0f comments/s; %d up to date, %d failed') % (
+        converted, comment_count, elapsed, converted / elapsed, comment_count / elapsed, skipped, failed))
+
+
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.132 Safari/537.36"
 }
@@ -868,22 +1162,97 @@ def get_danmaku_xml(cid: int) -> str:
     return r.text.encode("ISO-8859-1").decode("utf-8")
 
 
-def generate_ass(xml: str, output: str, width: int, height: int):
-    global fontsize
-    with open(f"{output}.temp", 'w', encoding='utf-8') as f:
-        f.write(xml)
+def get_font_size(width: int) -> float:
     if width < 1920:
-        fontsize = 25
+        return 25
     elif width < 3840:
-        fontsize = 50
+        return 50
     else:
-        fontsize = 80
+        return 80
+
+
+def get_stage_profiles(stages) -> list[StageProfile]:
+    # stages 为 (输出文件, 宽, 高) 的列表，字号按宽度选择
+    return [StageProfile(str(output), width, height, get_font_size(width)) for output, width, height in stages]
+
+
+def generate_ass_from_journal(journal: str, stages, start_time: float, end_time: float):
+    # 从弹幕日志逐条读取录制期间的弹幕，为每个 (输出文件, 宽, 高) 生成 ass；
+    # 每个尺寸重新读取一遍日志，不在内存中保存全部弹幕
+    try:
+        filters_regex = CompileCommentFilters(filter, filter_file)
+        for profile in get_stage_profiles(stages):
+            comments = ReorderComments(ReadCommentsDanmu(DanmuJournal.read_recorded(Path(journal), start_time, end_time), BASE_FONT_SIZE))
+            LayoutStageProfile(comments, profile, protect, font, alpha, duration_marquee, duration_still, filters_regex, reduce)
+    except Exception as e:
+        logger.error(f'生成弹幕文件失败: {e}')
+        raise
+
+
+def generate_ass_from_danmus(danmus, stages):
+    # 弹幕记录直接转换为 ProcessComments 的输入，不经过 xml 序列化与 DOM 解析
     try:
-        Danmaku2ASS(f"{output}.temp", format, output, width, height, protect, font, fontsize, alpha, duration_marquee, duration_still, filter, filter_file, reduce)
-        os.replace(f"{output}.temp", str(Path(output).with_suffix('.xml')))
+        comments = ReorderComments(ReadCommentsDanmu(danmus, BASE_FONT_SIZE))
+        filters_regex = CompileCommentFilters(filter, filter_file)
+        # 已在 post_processor 的进程池中运行，各尺寸依次生成，不再嵌套进程池
+        LayoutStageProfiles(comments, get_stage_profiles(stages), protect, font, alpha, duration_marquee, duration_still, filters_regex, reduce, max_workers=1)
     except Exception as e:
-        # print(e)
-        sys.exit(1)
+        logger.error(f'生成弹幕文件失败: {e}')
+        raise
+
+
+class LiveAssWriter:
+    # 录制过程中增量生成 ass：布局状态在批次之间保留，调用方每隔 flush_interval 秒把新弹幕批量交给 write，
+    # 录制中断时已写入的部分同样可用；排版与写文件较慢，调用方应在事件循环之外调用 write 与 close
+    flush_interval = 5
+
+    def __init__(self, path: Path, width: int, height: int, start_time: float):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.start_time = start_time
+        self.file = open(path, 'w', encoding='utf-8-sig', errors='replace', newline='\r\n')
+        self.font_size = get_font_size(width)
+        self.layout = CommentLayout(self.file, width, height, protect, font, self.font_size, alpha, duration_marquee, duration_still, CompileCommentFilters(filter, filter_file), reduce)
+        self.layout.write_head()
+        self.pending = []
+        self.count = 0
+
+    @classmethod
+    def from_journal(cls, path: Path, width: int, height: int, start_time: float, journal: Path, count: int):
+        # 先写入弹幕日志中已有的前 count 条弹幕，画面尺寸确定前收到的弹幕由此补上
+        writer = cls(path, width, height, start_time)
+        writer.write(itertools.islice(DanmuJournal.read(journal), count))
+        return writer
+
+    def append(self, danmu):
+        # 与 DanmuJournal.read_recorded 相同，按发送时间换算相对录制开始的出现时间
+        if danmu.send_time < self.start_time * 1000:
+            return
+        danmu.appear_time = (danmu.send_time - self.start_time * 1000) / 1000
+        self.pending.append(danmu)
+
+    def write(self, danmus):
+        for danmu in danmus:
+            self.append(danmu)
+        self.flush()
+
+    def flush(self):
+        comments = sorted(ReadCommentsDanmu(self.pending, self.font_size, self.count), key=CommentSortKey)
+        self.count += len(self.pending)
+        self.pending = []
+        self.layout.process(comments)
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def export_danmu_xml_from_journal(journal: str, output: str, start_time: float, end_time: float):
+    # 按需将录制期间的弹幕导出为 B 站格式的 xml
+    write_danmu_xml(DanmuJournal.read_recorded(Path(journal), start_time, end_time), output)
 
 
 def get_video_width_height(path: Path) -> (int, int):
@@ -904,3 +1273,6 @@ def get_video_width_height(path: Path) -> (int, int):
             height = stream['height']
             return width, height
 
+
+if __name__ == '__main__':
+    main_batch()
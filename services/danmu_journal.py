@@ -0,0 +1,59 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterator
+from loguru import logger
+from pydantic import ValidationError
+from services.util import Danmu, DanmuRecord
+
+
+class DanmuJournal:
+    # 每场录制对应一个只追加的 JSONL 弹幕日志，边接收边写入磁盘，
+    # 内存占用与直播时长无关，程序崩溃时最多丢失最近 fsync_interval 秒的弹幕
+    # 每行为 DanmuRecord.to_list() 的紧凑 JSON 数组，同时兼容旧版按字段名保存的对象
+    fsync_interval = 5
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+        self.count = 0
+        self.last_sync_time = time.time()
+
+    def append(self, danmu: DanmuRecord):
+        self.file.write(json.dumps(danmu.to_list(), ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.count += 1
+        if time.time() - self.last_sync_time >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync_time = time.time()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    @staticmethod
+    def read(path: Path) -> Iterator[DanmuRecord]:
+        # 逐行读取，跳过崩溃时未写完整的行
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    values = json.loads(line)
+                    if isinstance(values, list):
+                        yield DanmuRecord.from_list(values)
+                    else:
+                        yield DanmuRecord.from_danmu(Danmu.parse_obj(values))
+                except (ValidationError, ValueError, TypeError):
+                    logger.warning(f'跳过损坏的弹幕记录: {line.strip()}')
+
+    @classmethod
+    def read_recorded(cls, path: Path, start_time: float, end_time: float) -> Iterator[DanmuRecord]:
+        # 读取录制期间发送的弹幕，并换算为相对录制开始的出现时间
+        for danmu in cls.read(path):
+            if start_time * 1000 <= danmu.send_time <= end_time * 1000:
+                danmu.appear_time = (danmu.send_time - start_time * 1000) / 1000
+                yield danmu
@@ -1,5 +1,7 @@
-import aiohttp
+import re
 import traceback
+import importlib
+from collections import deque
 from config import get_config, save_config, Config
 from typing import Optional
 from abc import abstractmethod
@@ -8,14 +10,18 @@ from loguru import logger
 from pydantic import BaseModel
 from enum import IntEnum
 from pathlib import Path
-import aiofiles
+from services.flv import FlvParser, FlvWriter, TagType, StreamInfo
 from services.user_info import get_user_info_by_mid, UserInfo
-from services.util import Danmu, concat_videos
-from services.danmu_converter import get_video_width_height, generate_ass
+from services.util import DanmuRecord, get_process_usage
+from services.danmu_converter import get_video_width_height, generate_ass_from_journal, export_danmu_xml_from_journal, \
+    LiveAssWriter, ParseStageSize
+from services.danmu_journal import DanmuJournal
 from services.ass_render import fix_video
-from services.exceptions import DownloadPathException
+from services.exceptions import DownloadPathException, DownloaderNotFoundException
 from services.uploader import BiliBiliLiveUploader
-from services.live_service import LiveService
+from services.live_service import live_service
+from services.http_client import http_client
+from services.post_processor import post_processor
 import asyncio
 
 
@@ -41,6 +47,10 @@ class Downloader:
         file_name: str = ''
         status: Status = Status.UNDEFINED
         start_time: int = 0
+        # 实时录制统计
+        bitrate: float = 0
+        speed: float = 0
+        dropped_frames: int = 0
 
     def __init__(self, url, room_config: Config.MonitorLiveRoom, mid):
         if room_config.auto_download_path is None:
@@ -64,7 +74,14 @@ class Downloader:
         self.download_status = self.DownloadStatus()
         self.user_info: Optional[UserInfo] = None
         self.running_downloaders.append(self)
-        self.damu_list: list[Danmu] = []
+        self.danmu_journal: Optional[DanmuJournal] = None
+        # 弹幕日志创建前收到的弹幕
+        self.pending_danmus: list[DanmuRecord] = []
+        self.live_ass: Optional[LiveAssWriter] = None
+        # 等待写入实时 ass 的弹幕，由 live_ass_task 每隔 flush_interval 秒交给线程批量排版写入
+        self.live_ass_buffer: list[DanmuRecord] = []
+        self.live_ass_task: Optional[asyncio.Task] = None
+        self.live_ass_stop = asyncio.Event()
 
     @abstractmethod
     async def _download(self):
@@ -79,15 +96,89 @@ class Downloader:
     def cancel(self):
         self.download_status.status = self.DownloadStatus.Status.CANCELED
 
+    def open_danmu_journal(self, path: Path):
+        self.danmu_journal = DanmuJournal(path)
+        for danmu in self.pending_danmus:
+            self.danmu_journal.append(danmu)
+        self.pending_danmus = []
+
+    def open_live_ass(self, path: Path, width: int, height: int):
+        # 打开文件与回放弹幕日志都在线程中进行，期间收到的弹幕先进入 live_ass_buffer；
+        # 回放的弹幕数量在创建任务前同步确定，此后的弹幕只会进入 live_ass_buffer，不会重复
+        replay_count = None
+        if self.danmu_journal is not None:
+            self.danmu_journal.sync()
+            replay_count = self.danmu_journal.count
+        self.live_ass_task = asyncio.get_running_loop().create_task(
+            self.run_live_ass(path, width, height, replay_count))
+
+    async def run_live_ass(self, path: Path, width: int, height: int, replay_count: Optional[int]):
+        # 同一时间只有一个批次在线程中写入，停止时写入剩余弹幕并关闭文件
+        try:
+            if replay_count is not None:
+                # 回放打开时已写入日志的弹幕，之后的弹幕由 live_ass_buffer 补上
+                self.live_ass = await asyncio.to_thread(
+                    LiveAssWriter.from_journal, path, width, height, self.download_status.start_time,
+                    self.danmu_journal.path, replay_count)
+            else:
+                self.live_ass = await asyncio.to_thread(
+                    LiveAssWriter, path, width, height, self.download_status.start_time)
+            stopped = False
+            while not stopped:
+                try:
+                    await asyncio.wait_for(self.live_ass_stop.wait(), LiveAssWriter.flush_interval)
+                    stopped = True
+                except asyncio.TimeoutError:
+                    pass
+                danmus, self.live_ass_buffer = self.live_ass_buffer, []
+                await asyncio.to_thread(self.live_ass.write, danmus)
+            await asyncio.to_thread(self.live_ass.close)
+        except Exception as e:
+            # 未完整生成的 ass 由 save_danmus 重新生成
+            logger.error(f'录制期间生成弹幕失败: {path.name}')
+            logger.exception(e)
+            self.live_ass = None
+            self.live_ass_buffer = []
+
+    async def close_live_ass(self):
+        if self.live_ass_task is None:
+            return
+        self.live_ass_stop.set()
+        await self.live_ass_task
+
+    def add_danmu(self, danmu: DanmuRecord):
+        if self.danmu_journal is None:
+            self.pending_danmus.append(danmu)
+        else:
+            self.danmu_journal.append(danmu)
+        if self.live_ass_task is not None and not self.live_ass_task.done():
+            self.live_ass_buffer.append(danmu)
+
     async def create_session(self):
-        self.session = aiohttp.ClientSession(cookies=self.cookies, headers=self.default_headers)
+        self.session = http_client.create_session(cookies=self.cookies, headers=self.default_headers)
         return self.session
 
+    async def close_session(self):
+        if self.session is not None:
+            await http_client.close_session(self.session)
+        self.session = None
+
     def get_download_status(self) -> DownloadStatus:
         return self.download_status
 
 
-class LiveDefaultDownloader(Downloader):
+class LiveDownloader(Downloader):
+    # 直播录制的公共部分：文件命名、分段、推流地址刷新、保存与投稿
+
+    class DownloadMetrics(BaseModel):
+        # 各录制方式统一的吞吐与资源占用指标
+        downloader: str
+        downloaded_size: int = 0
+        elapsed_time: float = 0
+        average_bitrate: float = 0
+        reconnect_count: int = 0
+        cpu_time: float = 0
+        memory_usage: int = 0
 
     def __str__(self):
         return f'[{self.__class__.__name__}] {self.path}, 房间号：{self.room_info.data.room_id})'
@@ -96,12 +187,34 @@ class LiveDefaultDownloader(Downloader):
         super().__init__(url, room_config, room_info.data.room_id)
         self.download_status.target_path = room_config.auto_download_path
         self.room_info = room_info
-        self.live_service = LiveService()
+        self.live_service = live_service
         self.start_time = time.localtime()
+        self.download_file_list: list[Path] = []
+        self.stream_info: Optional[StreamInfo] = None
+
+    def get_cpu_time(self) -> float:
+        # 录制消耗的 CPU 时间(秒)，由各录制方式实现
+        return 0.0
+
+    def get_memory_usage(self) -> int:
+        # 录制占用的内存(字节)，由各录制方式实现
+        return 0
+
+    def get_metrics(self) -> DownloadMetrics:
+        elapsed_time = time.time() - self.download_status.start_time if self.download_status.start_time else 0
+        downloaded_size = self.download_status.current_downloaded_size
+        return self.DownloadMetrics(
+            downloader=self.__class__.__name__,
+            downloaded_size=downloaded_size,
+            elapsed_time=elapsed_time,
+            average_bitrate=downloaded_size * 8 / elapsed_time if elapsed_time > 0 else 0,
+            reconnect_count=max(len(self.download_file_list) - 1, 0),
+            cpu_time=self.get_cpu_time(),
+            memory_usage=self.get_memory_usage(),
+        )
 
-    @logger.catch
-    async def _download(self):
-        await super()._download()
+    async def prepare_target_path(self) -> str:
+        # 生成录制文件名，返回文件名
         self.user_info = await get_user_info_by_mid(self.room_info.data.uid)
         config = get_config()
         if not (self.path / self.user_info.data.card.name).exists():
@@ -117,36 +230,81 @@ class LiveDefaultDownloader(Downloader):
         self.start_time = time.localtime()
         file_name = time.strftime(file_name, time.localtime()) + '.flv'
         self.download_status.target_path = str(self.path / self.user_info.data.card.name / file_name)
-        async with aiofiles.open(self.path / self.user_info.data.card.name / file_name, 'wb') as f:
-            while self.download_status.status != self.DownloadStatus.Status.CANCELED:
-                try:
-                    async with self.session.get(self.url) as response:
-                        async for chunk in response.content.iter_chunked(1024):
-                            if self.download_status.status == self.DownloadStatus.Status.CANCELED:
-                                break
-                            self.download_status.current_downloaded_size += len(chunk)
-                            self.download_status.total_size = self.download_status.current_downloaded_size
-                            self.download_status.status = self.DownloadStatus.Status.DOWNLOADING
-                            await f.write(chunk)
-                except Exception as e:
-                    if self.download_status.status == self.DownloadStatus.Status.CANCELED:
-                        self.download_status.status = self.DownloadStatus.Status.UNDEFINED
-                        return
-                    logger.error(f'下载出错，正在重试')
-                    logger.exception(e)
-                    logger.error(f'重新获取推流地址中...')
-                    while True:
-                        try:
-                            self.url = await self.live_service.get_video_stream_url(self.room_info.data.room_id)
-                            break
-                        except Exception as e:
-                            logger.error(f'获取推流地址出错，正在重试')
-                            logger.exception(e)
-                            await asyncio.sleep(1)
+        self.open_danmu_journal(Path(self.download_status.target_path).with_suffix('.danmu.jsonl'))
+        return file_name
+
+    def update_stream_info(self, stream_info: StreamInfo):
+        # 以第一次得到的流信息为准，保存到 .stream.json 并开始在录制期间生成弹幕
+        if self.stream_info is not None:
+            if (stream_info.width, stream_info.height) != (self.stream_info.width, self.stream_info.height):
+                logger.warning(f'直播流分辨率发生变化: {self.stream_info.width}x{self.stream_info.height} -> '
+                               f'{stream_info.width}x{stream_info.height}')
+            return
+        self.stream_info = stream_info
+        logger.info(f'直播流信息: {stream_info.width}x{stream_info.height} {stream_info.fps} fps '
+                    f'{stream_info.video_codec}/{stream_info.audio_codec}')
+        target = Path(self.download_status.target_path)
+        with open(target.with_suffix('.stream.json'), 'w') as f:
+            f.write(stream_info.json())
+        if stream_info.has_stage_size():
+            self.open_live_ass(target.with_suffix('.zh-CN.ass'), stream_info.width, stream_info.height)
+
+    def next_slice_path(self, file_name: str) -> Path:
+        # 每次(重新)连接推流都写入一个新的分段文件
+        sliced_file_name = self.path / self.user_info.data.card.name / (file_name + f'.{len(self.download_file_list)}')
+        self.download_file_list.append(sliced_file_name)
+        return sliced_file_name
+
+    async def refresh_url(self):
+        logger.error(f'重新获取推流地址中...')
+        while True:
+            try:
+                self.url = await self.live_service.get_video_stream_url(self.room_info.data.room_id)
+                break
+            except Exception as e:
+                logger.error(f'获取推流地址出错，正在重试')
+                logger.exception(e)
+                await asyncio.sleep(1)
+
+    def get_recorded_slices(self) -> list[Path]:
+        return [file for file in self.download_file_list if file.exists() and file.stat().st_size > 0]
+
+    async def save_video(self):
+        download_file_list = self.get_recorded_slices()
+        if len(download_file_list) == 0:
+            logger.warning(f'没有录制到视频: {self.download_status.target_path}')
+        elif len(download_file_list) == 1:
+            download_file_list[0].rename(self.download_status.target_path)
+        else:
+            # 合并后重新封装，由 ffmpeg 写入整个文件的时长与关键帧索引，第一个分段的 onMetaData 只描述该分段
+            await fix_video(Path(self.download_status.target_path), input_files=download_file_list)
+
+    def is_video_saved(self) -> bool:
+        target = Path(self.download_status.target_path)
+        return target.exists() and target.stat().st_size > 0
+
+    async def finish(self):
         logger.opt(colors=True).info(f'<yellow>下载完成</yellow> 直播间：{self.room_info.data.title}已关闭')
         logger.info('正在保存视频...')
-        await fix_video(Path(self.download_status.target_path), transcode=self.room_config.transcode)
+        recorded = len(self.get_recorded_slices()) > 0
+        try:
+            await self.save_video()
+        except Exception as e:
+            logger.exception(e)
+        saved = self.is_video_saved()
+        if saved:
+            logger.info('保存成功')
+        elif recorded:
+            # 分段是录制内容唯一的副本，保存失败时保留以便手动恢复
+            logger.error(f'保存视频失败，已保留录制分段: {", ".join(str(file) for file in self.get_recorded_slices())}')
+        logger.info('正在保存弹幕...')
+        await self.save_danmus()
         logger.info('保存成功')
+        if not saved:
+            return
+        for file in self.download_file_list:
+            if file.exists():
+                file.unlink()
         if self.room_config.auto_upload.enabled:
             await self.upload()
 
@@ -202,62 +360,236 @@ class LiveDefaultDownloader(Downloader):
                 'title': self.room_config.auto_upload.title,
             }
         ])
-        bill_uploader.start()
-
         logger.info('正在上传视频...')
+        await post_processor.submit(post_processor.Priority.UPLOAD, f'上传视频 {file_name}', bill_uploader.run)
 
-    async def save_danmus(self, damus: list[Danmu]):
-        current_time = time.time() * 1000
-        valid_danmus = [damu for damu in damus if (current_time >= damu.send_time >= self.download_status.start_time)]
-        for damu in valid_danmus:
-            damu.appear_time = (damu.send_time - self.download_status.start_time * 1000) / 1000
+    async def save_danmus(self):
+        if self.danmu_journal is None:
+            return
+        self.danmu_journal.close()
+        await self.close_live_ass()
         video_file = Path(self.download_status.target_path)
-        video_width, video_height = get_video_width_height(video_file)
         ass_file = video_file.with_suffix('.zh-CN.ass')
-        generate_ass(Danmu.generate_danmu_xml(valid_danmus), str(ass_file), video_width, video_height)
+        start_time, end_time = self.download_status.start_time, time.time()
+        if self.stream_info is not None and self.stream_info.has_stage_size():
+            video_width, video_height = self.stream_info.width, self.stream_info.height
+        else:
+            logger.warning(f'录制时未获取到画面尺寸，读取视频分辨率: {video_file.name}')
+            video_width, video_height = await post_processor.submit(
+                post_processor.Priority.DANMAKU, f'读取视频分辨率 {video_file.name}', get_video_width_height, video_file)
+        stages = []
+        if self.live_ass is not None and (self.live_ass.width, self.live_ass.height) == (video_width, video_height):
+            logger.info(f'弹幕已在录制期间生成: {ass_file.name}')
+        else:
+            stages.append((str(ass_file), video_width, video_height))
+        for size in self.room_config.extra_ass_sizes:
+            width, height = ParseStageSize(size)
+            stages.append((str(video_file.with_suffix(f'.{width}x{height}.zh-CN.ass')), width, height))
+        if stages:
+            await post_processor.submit(
+                post_processor.Priority.DANMAKU, f'生成弹幕 {ass_file.name}', generate_ass_from_journal,
+                str(self.danmu_journal.path), stages, start_time, end_time, cpu_bound=True)
+        if self.room_config.save_danmu_xml:
+            xml_file = video_file.with_suffix('.zh-CN.xml')
+            await post_processor.submit(
+                post_processor.Priority.DANMAKU, f'导出弹幕 {xml_file.name}', export_danmu_xml_from_journal,
+                str(self.danmu_journal.path), str(xml_file), start_time, end_time)
+
+
+downloader_registry: dict[str, type[LiveDownloader]] = {}
+
+
+def register_downloader(name: str):
+    # 注册录制方式，可在配置文件中通过名称选择
+    def decorator(cls: type[LiveDownloader]) -> type[LiveDownloader]:
+        downloader_registry[name] = cls
+        return cls
+    return decorator
+
+
+def load_custom_downloader(name: str) -> type[LiveDownloader]:
+    # 按 module:ClassName 导入自定义录制插件并注册
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+    else:
+        module_name, _, class_name = name.rpartition('.')
+    try:
+        downloader_class = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise DownloaderNotFoundException(f'无法加载录制插件 {name}: {e}')
+    if not isinstance(downloader_class, type) or not issubclass(downloader_class, LiveDownloader):
+        raise DownloaderNotFoundException(f'录制插件 {name} 必须继承 LiveDownloader')
+    return register_downloader(name)(downloader_class)
+
+
+def get_downloader_class(room_config: Config.MonitorLiveRoom) -> type[LiveDownloader]:
+    # 直播间单独的设置优先，否则使用全局设置
+    name = room_config.downloader
+    if name is None:
+        download_config = get_config().live_config.download
+        if download_config.download_type == Config.LiveConfig.DownloadConfig.DownloadType.CUSTOM:
+            name = download_config.custom_downloader
+            if name is None:
+                raise DownloaderNotFoundException('custom_downloader 不能为空')
+        else:
+            name = download_config.downloader
+    if name not in downloader_registry:
+        return load_custom_downloader(name)
+    return downloader_registry[name]
 
 
-class LiveFfmpegDownloader(Downloader):
+@register_downloader('native')
+class LiveDefaultDownloader(LiveDownloader):
+    # 原生录制：边下载边解析 FLV tag，合并为大块写入，每次重连写入带完整文件头的新分段
 
-    def __str__(self):
-        return f'[{self.__class__.__name__}] {self.path}, 房间号：{self.room_info.data.room_id})'
+    def __init__(self, url: str, room_config: Config.MonitorLiveRoom, room_info):
+        super().__init__(url, room_config, room_info)
+        self.cpu_time = 0.0
+        self.parser: Optional[FlvParser] = None
+        self.writer: Optional[FlvWriter] = None
+
+    def get_cpu_time(self) -> float:
+        return self.cpu_time
+
+    def get_memory_usage(self) -> int:
+        memory_usage = 0
+        if self.parser is not None:
+            memory_usage += self.parser.buffered_size()
+        if self.writer is not None:
+            memory_usage += len(self.writer.buffer)
+        return memory_usage
+
+    @logger.catch
+    async def _download(self):
+        await super()._download()
+        file_name = await self.prepare_target_path()
+        if self.download_status.status == self.DownloadStatus.Status.CANCELED:
+            # 获取用户信息期间已被取消，没有录制内容，只关闭已打开的弹幕日志
+            self.danmu_journal.close()
+            await self.close_session()
+            return
+        self.download_status.status = self.DownloadStatus.Status.DOWNLOADING
+        while self.download_status.status != self.DownloadStatus.Status.CANCELED:
+            try:
+                await self.download_slice(self.next_slice_path(file_name))
+            except Exception as e:
+                if self.download_status.status == self.DownloadStatus.Status.CANCELED:
+                    break
+                logger.error(f'下载出错，正在重试')
+                logger.exception(e)
+            if self.download_status.status != self.DownloadStatus.Status.CANCELED:
+                await self.refresh_url()
+        await self.close_session()
+        await self.finish()
+
+    async def download_slice(self, sliced_file_name: Path):
+        parser = self.parser = FlvParser()
+        writer: Optional[FlvWriter] = None
+        got_keyframe = False
+        # 在第一个关键帧之前读取 onMetaData 与音视频编码
+        stream_info: Optional[StreamInfo] = StreamInfo()
+        try:
+            async with self.session.get(self.url) as response:
+                if response.status != 200:
+                    raise Exception(f'获取直播流失败: HTTP {response.status}')
+                async for chunk in response.content.iter_any():
+                    if self.download_status.status == self.DownloadStatus.Status.CANCELED:
+                        break
+                    self.download_status.current_downloaded_size += len(chunk)
+                    self.download_status.total_size = self.download_status.current_downloaded_size
+                    # 只统计两次 await 之间的同步解析与写入缓冲，await 期间事件循环运行的其他协程不计入本房间
+                    start_cpu_time = time.thread_time()
+                    tags = parser.feed(chunk)
+                    self.cpu_time += time.thread_time() - start_cpu_time
+                    if tags and writer is None:
+                        writer = self.writer = FlvWriter(sliced_file_name, parser.header)
+                        await writer.open()
+                    start_cpu_time = time.thread_time()
+                    for tag in tags:
+                        if stream_info is not None:
+                            stream_info.update_from_tag(tag)
+                            if tag.is_keyframe() or (stream_info.video_codec and stream_info.audio_codec):
+                                self.update_stream_info(stream_info)
+                                stream_info = None
+                        # 分段从关键帧开始，之前只保留 onMetaData 与音视频序列头
+                        if not got_keyframe:
+                            if tag.is_keyframe():
+                                got_keyframe = True
+                            elif tag.tag_type != TagType.SCRIPT and not tag.is_sequence_header():
+                                continue
+                        writer.add_tag(tag)
+                    self.cpu_time += time.thread_time() - start_cpu_time
+                    if writer is not None and writer.is_full():
+                        await writer.flush()
+        finally:
+            if writer is not None:
+                await writer.close()
+            self.parser = None
+            self.writer = None
+
+    async def save_video(self):
+        # 合并分段、重封装与写入关键帧索引在同一次写入中完成
+        download_file_list = self.get_recorded_slices()
+        if len(download_file_list) == 0:
+            logger.warning(f'没有录制到视频: {self.download_status.target_path}')
+            return
+        await fix_video(Path(self.download_status.target_path), transcode=self.room_config.transcode,
+                        input_files=download_file_list)
+
+
+@register_downloader('ffmpeg')
+class LiveFfmpegDownloader(LiveDownloader):
+    # 出错时用于报告的 ffmpeg 输出行数
+    stderr_buffer_lines = 200
+    # ffmpeg 输出的输入流信息，如 Stream #0:0: Video: h264 (High), yuv420p(progressive), 1920x1080, 30 fps
+    video_stream_regex = re.compile(r'Stream #\d+:\d+.*?: Video: (\w+)(?:.*?, (\d+)x(\d+))?(?:.*?, ([\d.]+) fps)?')
+    audio_stream_regex = re.compile(r'Stream #\d+:\d+.*?: Audio: (\w+)')
+    # -benchmark 在 ffmpeg 正常退出时输出的 CPU 时间，如 bench: utime=12.345s stime=1.234s rtime=600.000s
+    benchmark_regex = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
 
     def __init__(self, url: str, room_config: Config.MonitorLiveRoom, room_info):
-        super().__init__(url, room_config, room_info.data.room_id)
-        self.download_status.target_path = room_config.auto_download_path
-        self.room_info = room_info
-        self.live_service = LiveService()
-        self.start_time = time.localtime()
-        self.download_file_list: list[Path] = []
+        super().__init__(url, room_config, room_info)
         self.download_process = None
+        self.stderr_lines: deque[str] = deque(maxlen=self.stderr_buffer_lines)
+        # 已结束的 ffmpeg 进程累计消耗的 CPU 时间
+        self.finished_cpu_time = 0.0
+        self.last_cpu_time = 0.0
+
+    def get_cpu_time(self) -> float:
+        if self.download_process is not None and self.download_process.returncode is None:
+            self.sample_cpu_time()
+        return self.finished_cpu_time + self.last_cpu_time
+
+    def sample_cpu_time(self):
+        # 进程的 CPU 时间只增不减，进程已被回收时读取失败返回 0，保留之前的值
+        cpu_time, _ = get_process_usage(self.download_process.pid)
+        self.last_cpu_time = max(self.last_cpu_time, cpu_time)
+
+    def get_memory_usage(self) -> int:
+        if self.download_process is None or self.download_process.returncode is not None:
+            return 0
+        return get_process_usage(self.download_process.pid)[1]
 
     @logger.catch
     async def _download(self):
         await super()._download()
-        self.user_info = await get_user_info_by_mid(self.room_info.data.uid)
-        config = get_config()
-        if not (self.path / self.user_info.data.card.name).exists():
-            (self.path / self.user_info.data.card.name).mkdir()
-        file_name = (config.live_config.download_format
-                     .replace('%title', self.room_info.data.title)
-                     .replace('/', '_')
-                     .replace('\\', '_')
-                     .replace(':', '_')
-                     .replace('*', '_')
-                     .replace('?', '_')
-                     )
-        self.start_time = time.localtime()
-        file_name = time.strftime(file_name, time.localtime()) + '.flv'
-        self.download_status.target_path = str(self.path / self.user_info.data.card.name / file_name)
+        file_name = await self.prepare_target_path()
+        if self.download_status.status == self.DownloadStatus.Status.CANCELED:
+            # 获取用户信息期间已被取消，没有录制内容，只关闭已打开的弹幕日志
+            self.danmu_journal.close()
+            await self.close_session()
+            return
         self.download_status.status = self.DownloadStatus.Status.DOWNLOADING
         while self.download_status.status != self.DownloadStatus.Status.CANCELED:
-            sliced_file_name = self.path / self.user_info.data.card.name / (file_name + f'.{len(self.download_file_list)}')
-            self.download_file_list.append(sliced_file_name)
+            sliced_file_name = self.next_slice_path(file_name)
             try:
                 self.download_status.total_size = self.download_status.current_downloaded_size
                 # self.download_status.status = self.DownloadStatus.Status.DOWNLOADING
                 self.download_process = await asyncio.create_subprocess_exec(
                     "ffmpeg",
+                    "-nostats",
+                    "-benchmark",
+                    "-progress", "pipe:1",
                     "-user_agent", f"User-Agent: {self.default_headers['User-Agent']}",
                     "-headers", f"Referer: {self.default_headers['Referer']}",
                     "-i", self.url,
@@ -266,115 +598,70 @@ class LiveFfmpegDownloader(Downloader):
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE
                 )
-                stdout, stderr = await self.download_process.communicate()
+                self.stderr_lines.clear()
+                await asyncio.gather(
+                    self.read_progress(self.download_process.stdout, self.download_status.total_size),
+                    self.read_stderr(self.download_process.stderr)
+                )
+                # 被终止的 ffmpeg 不会输出 -benchmark 结果，输出结束后、进程被回收前再读取一次 CPU 时间
+                self.sample_cpu_time()
+                await self.download_process.wait()
+                self.finished_cpu_time += self.last_cpu_time
+                self.last_cpu_time = 0.0
                 if self.download_process.returncode != 0 and self.download_status.status != self.DownloadStatus.Status.CANCELED:
-                    raise Exception("下载出错，正在重试: " + stderr.decode("utf-8"))
+                    raise Exception("下载出错，正在重试: " + '\n'.join(self.stderr_lines))
 
             except Exception as e:
                 if self.download_status.status == self.DownloadStatus.Status.CANCELED:
-                    self.download_status.status = self.DownloadStatus.Status.UNDEFINED
-                    return
-                if "HTTP error 404 Not Found" not in str(e):
-                    self.download_file_list.append(sliced_file_name)
-                logger.debug(f'下载出错，正在重试: {traceback.format_exc()}')
-                logger.error(f'重新获取推流地址中...')
-                while True:
-                    try:
-                        self.url = await self.live_service.get_video_stream_url(self.room_info.data.room_id)
-                        break
-                    except Exception as e:
-                        logger.error(f'获取推流地址出错，正在重试')
-                        logger.exception(e)
-                        await asyncio.sleep(1)
-        logger.opt(colors=True).info(f'<yellow>下载完成</yellow> 直播间：{self.room_info.data.title}已关闭')
-        logger.info('正在保存视频...')
-        if len(self.download_file_list) == 1:
-            self.download_file_list[0].rename(self.download_status.target_path)
-        else:
-            await concat_videos(self.download_file_list, Path(self.download_status.target_path))
-        logger.info('保存成功')
-        logger.info('正在保存弹幕...')
-        await self.save_danmus(self.damu_list)
-        logger.info('保存成功')
-        if len(self.download_file_list) > 1:
-            for file in self.download_file_list:
-                if file.exists():
-                    file.unlink()
-        if self.room_config.auto_upload.enabled:
-            await self.upload()
-
-    async def upload(self):
-        if self.room_config.auto_upload.title is None:
-            logger.error('上传失败，标题不能为空')
-            return
-        if self.room_config.auto_upload.desc is None:
-            logger.error('上传失败，描述不能为空')
-            return
-        if self.room_config.auto_upload.tags is None:
-            logger.error('上传失败，标签不能为空')
-            return
-        if self.room_config.auto_upload.tid is None:
-            logger.error('上传失败，分区不能为空')
-            return
-        if self.room_config.auto_upload.source is None:
-            logger.error('上传失败，来源不能为空')
-            return
-
-        bill_uploader = BiliBiliLiveUploader()
-
-        bill_uploader.set_title(
-            time.strftime(
-                self.room_config.auto_upload.title.replace('%title', self.room_info.data.title),
-                self.start_time
-            )
-        )
-        ass_name = Path(self.download_status.target_path).with_suffix('.zh-CN.ass').name
-        file_name = Path(self.download_status.target_path).name
-        bill_uploader.set_desc(
-            time.strftime(
-                self.room_config.auto_upload.desc
-                    .replace('%title', self.room_info.data.title)
-                    .replace('%ass_name', ass_name)
-                    .replace('%file_name', file_name)
-                    .replace('%room_id', str(self.room_info.data.room_id))
-                    .replace('%uid', str(self.room_info.data.uid))
-                    .replace('%uname', self.user_info.data.card.name),
-                time.localtime()
-            )
-        )
-        bill_uploader.set_tags(self.room_config.auto_upload.tags)
-        bill_uploader.set_tid(self.room_config.auto_upload.tid)
-        bill_uploader.set_source(self.room_config.auto_upload.source)
-        if self.room_config.auto_upload.cover_path == 'AUTO':
-            bill_uploader.set_cover(f'{self.room_config.short_id}.jpg')
-        else:
-            bill_uploader.set_cover(self.room_config.auto_upload.cover)
-        bill_uploader.set_files([
-            {
-                'path': self.download_status.target_path,
-                'title': self.room_config.auto_upload.title,
-            }
-        ])
-        bill_uploader.start()
-
-        logger.info('正在上传视频...')
-
-    async def save_danmus(self, damus: list[Danmu]):
-        current_time = time.time() * 1000
-        valid_danmus = [damu for damu in damus if (current_time >= damu.send_time >= self.download_status.start_time)]
-        for damu in valid_danmus:
-            damu.appear_time = (damu.send_time - self.download_status.start_time * 1000) / 1000
-        video_file = Path(self.download_status.target_path)
-        if not video_file.exists():
-            while True:
-                video_file = Path(self.download_status.target_path)
-                if video_file.exists():
                     break
-        video_width, video_height = get_video_width_height(video_file)
-        ass_file = video_file.with_suffix('.zh-CN.ass')
-        generate_ass(Danmu.generate_danmu_xml(valid_danmus), str(ass_file), video_width, video_height)
+                logger.debug(f'下载出错，正在重试: {traceback.format_exc()}')
+                await self.refresh_url()
+        await self.close_session()
+        await self.finish()
+
+    async def read_progress(self, stream: asyncio.StreamReader, base_size: int):
+        # 逐行解析 ffmpeg -progress 输出的 key=value
+        async for line in stream:
+            key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+            try:
+                if key == 'total_size':
+                    self.download_status.current_downloaded_size = base_size + int(value)
+                elif key == 'bitrate':
+                    self.download_status.bitrate = float(value.replace('kbits/s', ''))
+                elif key == 'speed':
+                    self.download_status.speed = float(value.rstrip('x'))
+                elif key == 'drop_frames':
+                    self.download_status.dropped_frames = int(value)
+            except ValueError:
+                # 尚未开始时 ffmpeg 会输出 N/A
+                pass
+
+    async def read_stderr(self, stream: asyncio.StreamReader):
+        # 只保留最近的输出，避免长时间录制时在内存中积累全部日志
+        # 同时从 Output 之前的输入流信息中读取分辨率、帧率与编码
+        stream_info: Optional[StreamInfo] = StreamInfo()
+        async for line in stream:
+            text = line.decode('utf-8', 'replace').rstrip()
+            self.stderr_lines.append(text)
+            if match := self.benchmark_regex.search(text):
+                self.last_cpu_time = max(self.last_cpu_time, float(match.group(1)) + float(match.group(2)))
+                continue
+            if stream_info is None:
+                continue
+            if text.startswith('Output #'):
+                if stream_info.video_codec:
+                    self.update_stream_info(stream_info)
+                stream_info = None
+            elif match := self.video_stream_regex.search(text):
+                stream_info.video_codec = match.group(1)
+                if match.group(2):
+                    stream_info.width, stream_info.height = int(match.group(2)), int(match.group(3))
+                if match.group(4):
+                    stream_info.fps = float(match.group(4))
+            elif match := self.audio_stream_regex.search(text):
+                stream_info.audio_codec = match.group(1)
 
     def cancel(self):
         self.download_status.status = self.DownloadStatus.Status.CANCELED
-        self.download_process.kill()
-
+        if self.download_process is not None and self.download_process.returncode is None:
+            self.download_process.kill()
@@ -2,4 +2,8 @@ class NotAuthorizedException(Exception):
     pass
 
 class DownloadPathException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class DownloaderNotFoundException(Exception):
+    pass
@@ -0,0 +1,282 @@
+import os
+import struct
+from contextlib import nullcontext
+from enum import IntEnum
+from typing import Optional
+
+import aiofiles
+from pydantic import BaseModel
+
+
+FLV_HEADER = b'FLV\x01\x05\x00\x00\x00\x09'
+FLV_HEADER_SIZE = 9
+TAG_HEADER_SIZE = 11
+
+
+class FlvException(Exception):
+    pass
+
+
+class TagType(IntEnum):
+    AUDIO = 8
+    VIDEO = 9
+    SCRIPT = 18
+
+
+VIDEO_CODECS = {2: 'flv1', 4: 'vp6f', 5: 'vp6a', 7: 'h264', 12: 'hevc'}
+AUDIO_CODECS = {2: 'mp3', 10: 'aac'}
+
+
+def read_amf0(data: bytes, offset: int = 0):
+    # 读取一个 AMF0 值，返回 (值, 新的偏移)
+    marker = data[offset]
+    offset += 1
+    if marker == 0:
+        return struct.unpack_from('>d', data, offset)[0], offset + 8
+    if marker == 1:
+        return data[offset] != 0, offset + 1
+    if marker in (2, 12):
+        size_format = '>H' if marker == 2 else '>I'
+        size = struct.unpack_from(size_format, data, offset)[0]
+        offset += struct.calcsize(size_format)
+        return bytes(data[offset:offset + size]).decode('utf-8', 'replace'), offset + size
+    if marker in (3, 8):
+        if marker == 8:
+            # ECMA 数组的元素个数不可靠，以结束标记为准
+            offset += 4
+        value = {}
+        while True:
+            key_size = struct.unpack_from('>H', data, offset)[0]
+            offset += 2
+            if key_size == 0 and data[offset] == 9:
+                return value, offset + 1
+            key = bytes(data[offset:offset + key_size]).decode('utf-8', 'replace')
+            value[key], offset = read_amf0(data, offset + key_size)
+    if marker == 10:
+        count = struct.unpack_from('>I', data, offset)[0]
+        offset += 4
+        value = []
+        for _ in range(count):
+            item, offset = read_amf0(data, offset)
+            value.append(item)
+        return value, offset
+    if marker in (5, 6):
+        return None, offset
+    if marker == 11:
+        return struct.unpack_from('>d', data, offset)[0], offset + 10
+    raise FlvException(f'不支持的 AMF0 类型: {marker}')
+
+
+def parse_script_data(data: bytes) -> tuple:
+    # 脚本 tag 由名称(如 onMetaData)和对应的值组成
+    name, offset = read_amf0(data)
+    value, _ = read_amf0(data, offset)
+    return name, value
+
+
+class StreamInfo(BaseModel):
+    # 录制时从 onMetaData 与音视频 tag 中得到的流信息，随录制文件一起保存
+    width: int = 0
+    height: int = 0
+    fps: float = 0
+    video_codec: str = ''
+    audio_codec: str = ''
+
+    def update_from_tag(self, tag: 'FlvTag'):
+        if tag.tag_type == TagType.SCRIPT:
+            try:
+                name, metadata = parse_script_data(tag.data)
+            except (FlvException, struct.error, IndexError):
+                return
+            if name != 'onMetaData' or not isinstance(metadata, dict):
+                return
+            try:
+                self.width = int(metadata.get('width') or self.width)
+                self.height = int(metadata.get('height') or self.height)
+                self.fps = float(metadata.get('framerate') or metadata.get('videoframerate') or self.fps)
+            except (TypeError, ValueError):
+                pass
+        elif tag.tag_type == TagType.VIDEO and tag.data:
+            self.video_codec = VIDEO_CODECS.get(tag.data[0] & 0x0f, str(tag.data[0] & 0x0f))
+        elif tag.tag_type == TagType.AUDIO and tag.data:
+            self.audio_codec = AUDIO_CODECS.get(tag.data[0] >> 4, str(tag.data[0] >> 4))
+
+    def has_stage_size(self) -> bool:
+        return self.width > 0 and self.height > 0
+
+
+class FlvTag:
+    __slots__ = ('tag_type', 'timestamp', 'data')
+
+    def __init__(self, tag_type: int, timestamp: int, data: bytes):
+        self.tag_type = tag_type
+        self.timestamp = timestamp
+        self.data = data
+
+    def is_keyframe(self) -> bool:
+        # 序列头的帧类型同样标记为关键帧，需要排除
+        return (self.tag_type == TagType.VIDEO and len(self.data) > 0 and self.data[0] >> 4 == 1
+                and not self.is_sequence_header())
+
+    def is_sequence_header(self) -> bool:
+        # AVC/HEVC 的 AVCDecoderConfigurationRecord 或 AAC 的 AudioSpecificConfig
+        if len(self.data) < 2:
+            return False
+        if self.tag_type == TagType.VIDEO:
+            return self.data[0] & 0x0f in (7, 12) and self.data[1] == 0
+        if self.tag_type == TagType.AUDIO:
+            return self.data[0] >> 4 == 10 and self.data[1] == 0
+        return False
+
+    def to_bytes(self, timestamp: Optional[int] = None) -> bytes:
+        if timestamp is None:
+            timestamp = self.timestamp
+        timestamp &= 0xffffffff
+        size = len(self.data)
+        header = struct.pack(
+            '>BBHBHBBH',
+            self.tag_type,
+            size >> 16, size & 0xffff,
+            (timestamp >> 16) & 0xff, timestamp & 0xffff,
+            timestamp >> 24,
+            0, 0
+        )
+        return header + self.data + struct.pack('>I', TAG_HEADER_SIZE + size)
+
+
+class FlvParser:
+    # 增量解析 FLV 流，feed 任意大小的数据块，返回其中已完整的 tag
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.header: Optional[bytes] = None
+
+    def feed(self, data: bytes) -> list[FlvTag]:
+        buffer = self.buffer
+        buffer.extend(data)
+        offset = 0
+        if self.header is None:
+            if len(buffer) < FLV_HEADER_SIZE + 4:
+                return []
+            if buffer[:3] != b'FLV':
+                raise FlvException('不是有效的 FLV 数据')
+            header_size = struct.unpack_from('>I', buffer, 5)[0]
+            if len(buffer) < header_size + 4:
+                return []
+            self.header = bytes(buffer[:header_size])
+            offset = header_size + 4
+        tags = []
+        length = len(buffer)
+        while length - offset >= TAG_HEADER_SIZE:
+            tag_type, size_high, size_low, ts_high, ts_low, ts_ext = struct.unpack_from('>BBHBHB', buffer, offset)
+            size = (size_high << 16) | size_low
+            end = offset + TAG_HEADER_SIZE + size + 4
+            if end > length:
+                break
+            timestamp = (ts_ext << 24) | (ts_high << 16) | ts_low
+            data_start = offset + TAG_HEADER_SIZE
+            tags.append(FlvTag(tag_type, timestamp, bytes(buffer[data_start:data_start + size])))
+            offset = end
+        if offset:
+            del buffer[:offset]
+        return tags
+
+    def buffered_size(self) -> int:
+        return len(self.buffer)
+
+
+class FlvWriter:
+    # 合并写入：数据先写入内存缓冲，累计到 buffer_size 后再一次性写入磁盘
+
+    buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, path, header: bytes = FLV_HEADER):
+        self.path = path
+        self.header = header
+        self.file = None
+        self.buffer = bytearray()
+
+    async def open(self):
+        self.file = await aiofiles.open(self.path, 'wb')
+        self.write_bytes(self.header + b'\x00\x00\x00\x00')
+
+    def write_bytes(self, data: bytes):
+        self.buffer.extend(data)
+
+    def add_tag(self, tag: FlvTag, timestamp: Optional[int] = None):
+        # 只写入内存缓冲，由调用方在 is_full() 时调用 flush
+        self.write_bytes(tag.to_bytes(timestamp))
+
+    def is_full(self) -> bool:
+        return len(self.buffer) >= self.buffer_size
+
+    async def flush(self):
+        if self.buffer:
+            await self.file.write(bytes(self.buffer))
+            self.buffer.clear()
+
+    async def close(self):
+        if self.file is not None:
+            await self.flush()
+            await self.file.close()
+            self.file = None
+
+
+def concat_flv(input_files: list, output_file, progress_callback=None, chunk_size: int = 4 * 1024 * 1024):
+    # 顺序读取各分段并合并为一个文件：只保留第一个分段的文件头与 onMetaData，
+    # 相同的序列头只写一次，时间戳按分段依次平移，使合并后的时间轴连续
+    # output_file 可以是路径，也可以是已打开的二进制文件对象(如 ffmpeg 的 stdin)
+    # 保留的 onMetaData 中的时长、文件大小与关键帧只对应第一个分段，输出需经 ffmpeg 重新封装后才能正确拖动
+    total_size = sum(os.path.getsize(file) for file in input_files)
+    processed_size = 0
+    # 各类型最后写入的序列头
+    sequence_headers: dict[int, bytes] = {}
+    base_timestamp = 0
+    last_timestamp = -1
+    frame_interval = 40
+    header_written = False
+    script_written = False
+    if isinstance(output_file, (str, os.PathLike)):
+        output_context = open(output_file, 'wb', buffering=chunk_size)
+    else:
+        output_context = nullcontext(output_file)
+    with output_context as output:
+        for input_file in input_files:
+            parser = FlvParser()
+            start_timestamp = None
+            last_video_timestamp = None
+            with open(input_file, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    processed_size += len(chunk)
+                    for tag in parser.feed(chunk):
+                        if not header_written:
+                            output.write(parser.header + b'\x00\x00\x00\x00')
+                            header_written = True
+                        if tag.tag_type == TagType.SCRIPT:
+                            if not script_written:
+                                output.write(tag.to_bytes(0))
+                                script_written = True
+                            continue
+                        if tag.is_sequence_header():
+                            if sequence_headers.get(tag.tag_type) != tag.data:
+                                sequence_headers[tag.tag_type] = tag.data
+                                output.write(tag.to_bytes(base_timestamp))
+                            continue
+                        if start_timestamp is None:
+                            start_timestamp = tag.timestamp
+                        # 早于分段第一帧的 tag 不能回到上一分段的时间范围内
+                        timestamp = max(tag.timestamp - start_timestamp + base_timestamp, base_timestamp)
+                        if tag.tag_type == TagType.VIDEO:
+                            if last_video_timestamp is not None and 0 < tag.timestamp - last_video_timestamp < 1000:
+                                frame_interval = tag.timestamp - last_video_timestamp
+                            last_video_timestamp = tag.timestamp
+                        last_timestamp = max(last_timestamp, timestamp)
+                        output.write(tag.to_bytes(timestamp))
+                    if progress_callback:
+                        progress_callback(processed_size, total_size)
+            # 下一分段接在本分段最后一帧之后
+            if last_timestamp >= 0:
+                base_timestamp = last_timestamp + frame_interval
@@ -0,0 +1,58 @@
+import asyncio
+from typing import Optional
+
+from loguru import logger
+
+
+class HeartbeatScheduler:
+    # 所有弹幕流连接共用的心跳时间轮：一个周期分为若干槽，每个 tick 批量发送一个槽内连接的心跳，
+    # 连接认证成功时放入当前槽，之后每隔 interval 秒发送一次心跳，不再为每个房间单独创建任务
+
+    def __init__(self, interval: float = 30, tick: float = 1):
+        self.interval = interval
+        self.tick = tick
+        self.wheel: list[set] = [set() for _ in range(max(int(interval / tick), 1))]
+        self.slots: dict = {}
+        self.position = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def register(self, connection):
+        # connection 需实现 send_heartbeat()，注册时立即发送第一次心跳
+        self.unregister(connection)
+        self.wheel[self.position].add(connection)
+        self.slots[connection] = self.position
+        self.start()
+        asyncio.get_running_loop().create_task(self.beat(connection))
+
+    def unregister(self, connection):
+        slot = self.slots.pop(connection, None)
+        if slot is not None:
+            self.wheel[slot].discard(connection)
+
+    async def beat(self, connection):
+        try:
+            await connection.send_heartbeat()
+        except Exception as e:
+            logger.debug(f'发送心跳失败: {e}')
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            # 事件循环阻塞过久时不补发错过的 tick
+            next_tick = max(next_tick + self.tick, loop.time())
+            await asyncio.sleep(max(next_tick - loop.time(), 0))
+            self.position = (self.position + 1) % len(self.wheel)
+            due = self.wheel[self.position]
+            if due:
+                await asyncio.gather(*(self.beat(connection) for connection in list(due)))
+
+
+heartbeat_scheduler = HeartbeatScheduler()
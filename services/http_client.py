@@ -0,0 +1,50 @@
+import aiohttp
+from typing import Optional
+from loguru import logger
+
+
+class HttpClient:
+    # 进程内共享的 HTTP 连接池：各服务模块的会话保留各自的请求头与 cookies，
+    # 但共用同一个 TCPConnector，从而复用连接、缓存 DNS 并统一关闭
+    limit = 200
+    limit_per_host = 30
+    keepalive_timeout = 60
+    ttl_dns_cache = 300
+
+    def __init__(self):
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.sessions: list[aiohttp.ClientSession] = []
+
+    def get_connector(self) -> aiohttp.TCPConnector:
+        if self.connector is None or self.connector.closed:
+            self.connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+        return self.connector
+
+    def create_session(self, **kwargs) -> aiohttp.ClientSession:
+        # 创建共用连接池的会话，必须在事件循环中调用
+        session = aiohttp.ClientSession(connector=self.get_connector(), connector_owner=False, **kwargs)
+        self.sessions.append(session)
+        return session
+
+    async def close_session(self, session: aiohttp.ClientSession):
+        if session in self.sessions:
+            self.sessions.remove(session)
+        await session.close()
+
+    async def close(self):
+        # 关闭所有会话与连接池
+        for session in self.sessions:
+            await session.close()
+        self.sessions = []
+        if self.connector is not None and not self.connector.closed:
+            await self.connector.close()
+        self.connector = None
+        logger.debug('HTTP 连接池已关闭')
+
+
+http_client = HttpClient()
@@ -1,31 +1,51 @@
-import struct
 
 from pydantic import BaseModel
-from enum import IntEnum
 from config import get_config, Config
 from typing import Optional
 import asyncio
-import aiohttp
-import json
-from services.downloader import LiveDefaultDownloader, LiveFfmpegDownloader
-import websockets
-import zlib
+from services.downloader import LiveDownloader, get_downloader_class
 from loguru import logger
 import time
-from services.util import Danmu
-from services.exceptions import DownloadPathException
-from services.live_service import RoomInfo, LiveService
+from services.util import DanmuRecord
+from services.exceptions import DownloadPathException, DownloaderNotFoundException
+from services.live_service import RoomInfo, LiveService, live_service
+from services.http_client import http_client
+from services.comment_filter import CommentFilter
+from services.command_router import CommandRouter
+from services.message_stream import Operation, iter_packets, decode_commands
+from services.message_connection import MessageStreamConnection
 
 config = get_config()
+comment_filter = CommentFilter.load(config.live_config.danmu_filters, config.live_config.danmu_filter_file)
+# log_room_commands 开启时以 DEBUG 级别记录的命令及其日志格式
+command_log_formats = {
+    'SEND_GIFT': lambda command: f'收到礼物: {command["data"]["uname"]} 赠送 {command["data"]["num"]} 个 {command["data"]["giftName"]}',
+    'WELCOME': lambda command: f'欢迎 {command["data"]["uname"]} 进入直播间',
+    'WELCOME_GUARD': lambda command: f'欢迎 {command["data"]["username"]} 进入直播间',
+    'SYS_MSG': lambda command: f'系统消息: {command["msg"]}',
+    'ROOM_BLOCK_MSG': lambda command: f'直播间被封禁: {command["msg"]}',
+    'ROOM_SILENT_ON': lambda command: '直播间已开启全员禁言',
+    'ROOM_SILENT_OFF': lambda command: '直播间已关闭全员禁言',
+    'ROOM_REAL_TIME_MESSAGE_UPDATE': lambda command: f'直播间人气值更新: {command["data"]["fans"]}',
+    'ROOM_RANK': lambda command: f'直播间排行榜更新: {command["data"]}',
+    'ROOM_CHANGE': lambda command: f'直播间信息更新: {command["data"]}',
+    'ROOM_ADMINS': lambda command: f'直播间管理员更新: {command["data"]}',
+    'ROOM_ADMINS_SET': lambda command: f'直播间管理员设置: {command["data"]}',
+    'ROOM_ADMINS_UNSET': lambda command: f'直播间管理员取消: {command["data"]}',
+    'ROOM_LOCK': lambda command: '直播间已开启上锁',
+    'ROOM_UNLOCK': lambda command: '直播间已关闭上锁',
+    'ROOM_ADMIN_ENTER': lambda command: f'管理员 {command["data"]["username"]} 进入直播间',
+    'NOTICE_MSG': lambda command: f'通知消息: {command["msg"]}',
+    'ACTIVITY_BANNER_UPDATE_V2': lambda command: f'活动信息更新: {command["data"]}',
+    'ANCHOR_LOT_CHECKSTATUS': lambda command: f'主播开启抽奖: {command["data"]}',
+    'ANCHOR_LOT_START': lambda command: f'主播开始抽奖: {command["data"]}',
+    'ANCHOR_LOT_END': lambda command: f'主播结束抽奖: {command["data"]}',
+    'ANCHOR_LOT_AWARD': lambda command: f'主播抽奖结果: {command["data"]}',
+}
 
 
 class MonitorRoom:
-    class MessageStreamCommand(IntEnum):
-        HEARTBEAT = 2
-        HEARTBEAT_REPLY = 3
-        COMMAND = 5
-        AUTHENTICATION = 7
-        AUTHENTICATION_REPLY = 8
+    MessageStreamCommand = Operation
 
     class DanmuMessage(BaseModel):
         cmd: str
@@ -36,46 +56,65 @@ class MonitorRoom:
         self.live = False
         self.down_video = False
         self.room_config = room_config
+        self.uid: Optional[int] = None
         self.room_info: Optional[RoomInfo] = None
         self.download_status: Optional[LiveService.DownloadStatus] = None
-        self.downloader: Optional[LiveFfmpegDownloader] = None
-        self.message_stream_data = None
+        self.downloader: Optional[LiveDownloader] = None
         self.session = None
-        self.message_ws = None
-        self.danmus: list[Danmu] = []
+        self.message_connection = MessageStreamConnection(self.room_id, self.get_session, self.handle_message)
+        self.message_stream_task: Optional[asyncio.Task] = None
+        self.download_task: Optional[asyncio.Task] = None
+        self.update_lock = asyncio.Lock()
+        self.last_status_check = 0.0
+        self.danmu_count = 0
+        self.command_router = CommandRouter()
+        self.subscribe_commands()
         self.default_headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36',
             'Origin': 'https://live.bilibili.com',
-            'Connection': 'Upgrade'
         }
 
     async def update_room_info(self):
-        while True:
-            try:
-                self.room_info = await live_service.get_room_info(self.room_id)
-                self.room_id = self.room_info.data.room_id
-                self.live = self.room_info.data.live_status == RoomInfo.Data.LiveStatus.LIVE
-                if self.live and self.download_status is None and self.room_config.auto_download:
-                    if self.message_stream_data is None:
-                        asyncio.get_running_loop().create_task(self.init_message_ws())
-                    url = await live_service.get_video_stream_url(self.room_id)
-                    asyncio.get_running_loop().create_task(self.download_live_video(url))
-                    if self.room_config.auto_upload.enabled and self.room_config.auto_upload.cover_path == 'AUTO':
-                        await self.download_live_image(self.room_info.data.user_cover)
-                    self.download_status = LiveService.DownloadStatus(
-                        status=LiveService.DownloadStatus.Status.DOWNLOADING)
-                if self.room_info.data.live_status != RoomInfo.Data.LiveStatus.LIVE and self.download_status is not None:
-                    self.live = False
+        # 获取房间信息，并根据直播状态开始或停止录制
+        try:
+            self.room_info = await live_service.get_room_info(self.room_id)
+            self.room_id = self.room_info.data.room_id
+            self.uid = self.room_info.data.uid
+            if self.message_stream_task is None:
+                self.message_stream_task = asyncio.get_running_loop().create_task(self.run_message_stream())
+            await self.update_live_status(self.room_info.data.live_status)
+        except Exception as e:
+            logger.debug(f'更新房间信息失败: {e}')
+
+    async def update_live_status(self, live_status: RoomInfo.Data.LiveStatus):
+        async with self.update_lock:
+            self.live = live_status == RoomInfo.Data.LiveStatus.LIVE
+            if self.live and self.download_status is None and self.room_config.auto_download:
+                url = await live_service.get_video_stream_url(self.room_id)
+                self.download_task = asyncio.get_running_loop().create_task(self.download_live_video(url))
+                if self.room_config.auto_upload.enabled and self.room_config.auto_upload.cover_path == 'AUTO':
+                    await self.download_live_image(self.room_info.data.user_cover)
+                self.download_status = LiveService.DownloadStatus(
+                    status=LiveService.DownloadStatus.Status.DOWNLOADING)
+            if not self.live and self.download_status is not None:
+                if self.downloader is not None:
                     await self.stop_download()
-            except Exception as e:
-                logger.debug(f'更新房间信息失败: {e}')
-            await asyncio.sleep(10)
+                else:
+                    # 录制任务已创建但录制器尚未创建，直接取消，避免状态停留在录制中
+                    self.cancel_pending_download()
+
+    def is_status_changed(self, live_status: RoomInfo.Data.LiveStatus) -> bool:
+        # 判断批量查询到的直播状态是否需要重新获取房间信息
+        live = live_status == RoomInfo.Data.LiveStatus.LIVE
+        if live != self.live:
+            return True
+        if live and self.room_config.auto_download and self.download_status is None:
+            return True
+        return not live and self.download_status is not None
 
     async def download_live_image(self, url: str):
         # 下载直播封面
-        if self.session is None:
-            self.session = aiohttp.ClientSession(headers=self.default_headers)
-        async with self.session.get(url) as response:
+        async with self.get_session().get(url) as response:
             with open(f'{self.room_config.short_id}.jpg', 'wb') as f:
                 f.write(await response.read())
 
@@ -85,10 +124,13 @@ class MonitorRoom:
             """
         self.download_status = LiveService.DownloadStatus(status=LiveService.DownloadStatus.Status.DOWNLOADING)
         try:
-            self.downloader = LiveFfmpegDownloader(url, self.room_config, self.room_info)
+            self.downloader = get_downloader_class(self.room_config)(url, self.room_config, self.room_info)
         except DownloadPathException as e:
             logger.error(f'请在配置文件中指定下载路径！: {e}')
             exit(1)
+        except DownloaderNotFoundException as e:
+            logger.error(f'录制方式配置错误！: {e}')
+            exit(1)
         self.downloader.download()
         while True:
             if self.download_status is None:
@@ -97,211 +139,98 @@ class MonitorRoom:
                 return
             logger.info(
                 f'正在录制直播间: {self.room_info.data.title}({self.room_info.data.room_id if self.room_info.data.short_id == 0 else self.room_info.data.short_id})')
+            logger.debug(f'录制状态: {self.downloader.get_metrics()}')
             await asyncio.sleep(10)
 
-    async def get_live_message_stream_key(self, room_id: int) -> str:
-        # 获取直播弹幕流密钥
-        url = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo'
-        params = {
-            'id': room_id
-        }
-        async with self.session.get(url, params=params) as response:
-            self.message_stream_data = LiveService.MessageKeyResponse.parse_obj(await response.json())
-            return self.message_stream_data.data.token
-
-    @logger.catch
-    async def init_message_ws(self):
-        # 初始化弹幕流连接
-        self.session = aiohttp.ClientSession(cookies=live_service.cookies, headers=self.default_headers)
-        key = await self.get_live_message_stream_key(self.room_id)
-        logger.debug('弹幕流连接成功')
-        message: bytes = json.dumps({
-            'uid': get_config().mid,
-            'roomid': self.room_id,
-            'protover': 2,
-            'platform': 'web',
-            'type': 2,
-            'key': key
-        },
-            separators=(',', ':')
-        ).encode('utf-8')
-        self.message_ws = await websockets.connect('wss://{}:{}/sub'.format(
-            self.message_stream_data.data.host_list[0].host,
-            self.message_stream_data.data.host_list[0].wss_port
-        ))
-        await self.send_ws_message(MonitorRoom.MessageStreamCommand.AUTHENTICATION, message)
-        await self.send_heartbeat()
-        await self.receive_message()
-
-    def generate_message_stream(self, command: MessageStreamCommand, payload: bytes) -> bytes:
-        # 生成websocket消息
-        header = bytearray()
-        header.extend(struct.pack('>I', 16 + len(payload)))
-        header.extend(struct.pack('>H', 16))
-        if command == MonitorRoom.MessageStreamCommand.HEARTBEAT or command == MonitorRoom.MessageStreamCommand.AUTHENTICATION:
-            header.extend(struct.pack('>H', 1))
-        else:
-            header.extend(struct.pack('>H', 0))
-        header.extend(struct.pack('>I', command))
-        header.extend(struct.pack('>I', self.message_stream_data.current_command_count))
-        return bytes(header) + payload
-
-    async def send_ws_message(self, command: 'MonitorRoom.MessageStreamCommand', message: bytes):
-        message = self.generate_message_stream(command, message)
-        logger.debug(f'发送消息: {message}')
-        try:
-            await self.message_ws.send(message)
-        except Exception as e:
-            logger.error(f'发送消息失败: {e}')
-            await self.close_session()
-            await self.init_message_ws()
-        self.message_stream_data.current_command_count += 1
-
-    async def send_heartbeat(self):
-        # 发送心跳
-        await self.send_ws_message(MonitorRoom.MessageStreamCommand.HEARTBEAT, b'')
-
-    async def receive_message(self):
-        # 接收消息
-        while self.download_status is not None and self.download_status.status == LiveService.DownloadStatus.Status.DOWNLOADING:
-            try:
-                message = await self.message_ws.recv()
-                # logger.debug(f'接收消息: {message}')
-                try:
-                    await self.handle_message(message)
-                except Exception as e:
-                    logger.debug(f'处理消息失败: {e}')
-            except Exception as e:
-                logger.error(f'接收消息出错: {e}')
-                break
-        await self.close_session()
+    def is_message_stream_connected(self) -> bool:
+        return self.message_connection.is_connected()
 
-    async def close_session(self):
-        await self.session.close()
-        self.session = None
+    async def run_message_stream(self):
+        # 保持弹幕流常连接，直播开始与结束由弹幕流中的 LIVE / PREPARING 命令立即触发
+        # 短号在获取房间信息后才会换成真实房间号
+        self.message_connection.room_id = self.room_id
+        await self.message_connection.run()
 
-    async def send_heartbeat_loop(self):
-        while self.download_status is not None:
-            await self.send_heartbeat()
-            await asyncio.sleep(25)
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = http_client.create_session(cookies=live_service.cookies, headers=self.default_headers)
+        return self.session
 
     async def handle_message(self, message: bytes):
-        # 处理消息
-        header = message[:16]
-        payload = message[16:]
-        length, header_length, version, operation, sequence_id = struct.unpack('>IHHII', header)
-        if operation == MonitorRoom.MessageStreamCommand.HEARTBEAT_REPLY:
-            logger.debug('收到心跳回复')
-        elif operation == MonitorRoom.MessageStreamCommand.AUTHENTICATION_REPLY:
-            logger.debug('收到认证回复')
-            asyncio.get_running_loop().create_task(self.send_heartbeat_loop())
-        elif operation == MonitorRoom.MessageStreamCommand.COMMAND:
-            # logger.debug('收到命令')
-            if version == 2:
-                decompressed_message = zlib.decompress(payload)
-                commands = await self.extract_commands(decompressed_message)
-            else:
-                commands = [json.loads(payload.decode('utf-8'))]
-            for command in commands:
-                if command['cmd'] == 'DANMU_MSG':
-                    if len(self.danmus) % 20 == 0:
-                        logger.info(f'在直播间{self.room_id}收到{len(self.danmus)}条弹幕')
-                    await self.process_danmu(command['info'])
-                elif command['cmd'] == 'SEND_GIFT':
-                    logger.debug(
-                        f'收到礼物: {command["data"]["uname"]} 赠送 {command["data"]["num"]} 个 {command["data"]["giftName"]}')
-                elif command['cmd'] == 'WELCOME':
-                    logger.debug(f'欢迎 {command["data"]["uname"]} 进入直播间')
-                elif command['cmd'] == 'WELCOME_GUARD':
-                    logger.debug(f'欢迎 {command["data"]["username"]} 进入直播间')
-                elif command['cmd'] == 'SYS_MSG':
-                    logger.debug(f'系统消息: {command["msg"]}')
-                elif command['cmd'] == 'PREPARING':
-                    logger.debug('直播间准备中')
-                elif command['cmd'] == 'LIVE':
-                    logger.debug('直播开始')
-                elif command['cmd'] == 'PREPARING':
-                    logger.debug('直播结束')
-                elif command['cmd'] == 'ROOM_BLOCK_MSG':
-                    logger.debug(f'直播间被封禁: {command["msg"]}')
-                elif command['cmd'] == 'ROOM_SILENT_ON':
-                    logger.debug(f'直播间已开启全员禁言')
-                elif command['cmd'] == 'ROOM_SILENT_OFF':
-                    logger.debug(f'直播间已关闭全员禁言')
-                elif command['cmd'] == 'ROOM_REAL_TIME_MESSAGE_UPDATE':
-                    logger.debug(f'直播间人气值更新: {command["data"]["fans"]}')
-                elif command['cmd'] == 'ROOM_RANK':
-                    logger.debug(f'直播间排行榜更新: {command["data"]}')
-                elif command['cmd'] == 'ROOM_CHANGE':
-                    logger.debug(f'直播间信息更新: {command["data"]}')
-                elif command['cmd'] == 'ROOM_ADMINS':
-                    logger.debug(f'直播间管理员更新: {command["data"]}')
-                elif command['cmd'] == 'ROOM_ADMINS_SET':
-                    logger.debug(f'直播间管理员设置: {command["data"]}')
-                elif command['cmd'] == 'ROOM_ADMINS_UNSET':
-                    logger.debug(f'直播间管理员取消: {command["data"]}')
-                elif command['cmd'] == 'ROOM_BLOCK_MSG':
-                    logger.debug(f'直播间被封禁: {command["msg"]}')
-                elif command['cmd'] == 'ROOM_LOCK':
-                    logger.debug(f'直播间已开启上锁')
-                elif command['cmd'] == 'ROOM_UNLOCK':
-                    logger.debug(f'直播间已关闭上锁')
-                elif command['cmd'] == 'ROOM_ADMIN_ENTER':
-                    logger.debug(f'管理员 {command["data"]["username"]} 进入直播间')
-                elif command['cmd'] == 'NOTICE_MSG':
-                    logger.debug(f'通知消息: {command["msg"]}')
-                elif command['cmd'] == 'ACTIVITY_BANNER_UPDATE_V2':
-                    logger.debug(f'活动信息更新: {command["data"]}')
-                elif command['cmd'] == 'ANCHOR_LOT_CHECKSTATUS':
-                    logger.debug(f'主播开启抽奖: {command["data"]}')
-                elif command['cmd'] == 'ANCHOR_LOT_START':
-                    logger.debug(f'主播开始抽奖: {command["data"]}')
-                elif command['cmd'] == 'ANCHOR_LOT_END':
-                    logger.debug(f'主播结束抽奖: {command["data"]}')
-                elif command['cmd'] == 'ANCHOR_LOT_AWARD':
-                    logger.debug(f'主播抽奖结果: {command["data"]}')
-
-    @classmethod
-    async def extract_commands(cls, message: bytes) -> list:
-        # 提取命令
-        commands = []
-        while len(message) > 0:
-            header = message[:16]
-            total_length, header_length, version, operation, sequence_id = struct.unpack('>IHHII', header)
-            payload = message[16:total_length]
-            message = message[total_length:]
-            commands.append(json.loads(payload.decode('utf-8')))
-        return commands
+        # 处理消息，一条 websocket 消息中可能包含多个包
+        for version, operation, payload in iter_packets(message):
+            if operation == MonitorRoom.MessageStreamCommand.HEARTBEAT_REPLY:
+                self.message_connection.on_heartbeat_reply()
+            elif operation == MonitorRoom.MessageStreamCommand.COMMAND:
+                await self.handle_commands(await decode_commands(version, payload, self.command_router))
+
+    def subscribe_commands(self):
+        # 订阅本房间需要处理的命令，录制、弹幕等组件也可以通过 command_router 订阅其他命令
+        self.command_router.subscribe('DANMU_MSG', self.on_danmu_command)
+        self.command_router.subscribe('LIVE', self.on_live_command)
+        self.command_router.subscribe('PREPARING', self.on_preparing_command)
+        if config.live_config.log_room_commands:
+            for cmd in command_log_formats:
+                self.command_router.subscribe(cmd, self.log_command)
+
+    async def handle_commands(self, commands: list[dict]):
+        for command in commands:
+            await self.command_router.dispatch(command)
+
+    async def on_danmu_command(self, command: dict):
+        await self.process_danmu(command['info'])
+
+    def on_live_command(self, command: dict):
+        logger.debug('直播开始')
+        asyncio.get_running_loop().create_task(self.update_room_info())
+
+    def on_preparing_command(self, command: dict):
+        logger.debug('直播结束')
+        asyncio.get_running_loop().create_task(self.update_live_status(RoomInfo.Data.LiveStatus.NOT_LIVE))
+
+    @staticmethod
+    def log_command(command: dict):
+        # 仅在有日志输出接收 DEBUG 级别时才格式化消息
+        logger.opt(lazy=True).debug('{}', lambda: command_log_formats[command['cmd']](command))
 
     async def process_danmu(self, danmu):
-        # 处理弹幕
-        danmu_info = {
-            'danmu_type': danmu[0][1],
-            'font_size': danmu[0][2],
-            'color': danmu[0][3],
-            'send_time': danmu[0][4],
-            'mid_hash': danmu[2][0],
-            'd_mid': 123456789,
-            'content': danmu[1],
-        }
-        if self.download_status is not None and self.download_status == LiveService.DownloadStatus.Status.DOWNLOADING:
-            # 录制中
-            danmu_info['appear_time'] = time.time() - self.downloader.get_download_status().start_time
-        else:
-            # 未录制
-            danmu_info['appear_time'] = -1
-        self.danmus.append(Danmu.parse_obj(danmu_info))
+        # 处理弹幕，热路径上直接构造轻量记录，不经过 pydantic 校验
+        if self.download_status is None or self.downloader is None:
+            # 未录制时弹幕流仍保持连接，不保存弹幕
+            return
+        if comment_filter and comment_filter.search(danmu[1]):
+            return
+        info = danmu[0]
+        self.downloader.add_danmu(DanmuRecord(
+            appear_time=time.time() - self.downloader.get_download_status().start_time,
+            danmu_type=info[1],
+            font_size=info[2],
+            color=info[3],
+            send_time=info[4],
+            mid_hash=str(danmu[2][0]),
+            d_mid=123456789,
+            content=danmu[1],
+        ))
+        self.danmu_count += 1
+        if self.danmu_count % 20 == 0:
+            logger.info(f'在直播间{self.room_id}收到{self.danmu_count}条弹幕')
+
+    def cancel_pending_download(self):
+        if self.download_task is not None and not self.download_task.done():
+            self.download_task.cancel()
+        self.download_task = None
+        self.download_status = None
+        self.danmu_count = 0
+        logger.info(f'直播间{self.room_id}在录制开始前已下播，取消录制')
 
     async def stop_download(self):
         # 停止录制
         logger.info(
-            f'录制结束: 录制时长 {round(time.time() - self.downloader.get_download_status().start_time)} 秒, 弹幕数量 {len(self.danmus)} 条')
+            f'录制结束: 录制时长 {round(time.time() - self.downloader.get_download_status().start_time)} 秒, 弹幕数量 {self.danmu_count} 条')
         self.download_status = LiveService.DownloadStatus(status=LiveService.DownloadStatus.Status.FINISHED)
-        self.downloader.damu_list = self.danmus
         self.downloader.cancel()
         self.download_status = None
-        self.message_stream_data = None
-        self.danmus = []
+        self.danmu_count = 0
 
     async def test_slice_video(self):
         self.downloader.download_process.kill()
@@ -328,7 +257,57 @@ async def test(monitor_room: MonitorRoom):
     await monitor_room.test_slice_video()
 
 
-live_service = LiveService()
+class RoomStatusPoller:
+    # 批量轮询所有监听直播间的直播状态，仅对状态变化的直播间单独获取房间信息
+    batch_size = 100
+
+    def __init__(self, interval: int = 10, consistency_interval: int = 60):
+        self.interval = interval
+        # 弹幕流已连接的直播间由 LIVE / PREPARING 命令驱动，轮询仅作为低频一致性检查
+        self.consistency_interval = consistency_interval
+        self.rooms: list[MonitorRoom] = []
+
+    def add_room(self, monitor_room: MonitorRoom):
+        self.rooms.append(monitor_room)
+
+    async def poll(self):
+        now = time.time()
+        changed_rooms: list[MonitorRoom] = [room for room in self.rooms if room.uid is None]
+        uid_rooms: dict[int, list[MonitorRoom]] = {}
+        for room in self.rooms:
+            if room.uid is None:
+                continue
+            if room.is_message_stream_connected() and now - room.last_status_check < self.consistency_interval:
+                continue
+            room.last_status_check = now
+            uid_rooms.setdefault(room.uid, []).append(room)
+        uids = list(uid_rooms)
+        for i in range(0, len(uids), self.batch_size):
+            batch = uids[i:i + self.batch_size]
+            try:
+                statuses = await live_service.get_room_status_by_uids(batch)
+            except Exception as e:
+                logger.debug(f'批量获取直播间状态失败: {e}')
+                for uid in batch:
+                    changed_rooms.extend(uid_rooms[uid])
+                continue
+            for uid in batch:
+                status = statuses.get(uid)
+                for room in uid_rooms[uid]:
+                    if status is None or room.is_status_changed(status.live_status):
+                        changed_rooms.append(room)
+        await asyncio.gather(*[room.update_room_info() for room in changed_rooms])
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.debug(f'轮询直播间状态失败: {e}')
+            await asyncio.sleep(self.interval)
+
+
+room_status_poller = RoomStatusPoller()
 
 
 def start_monitor():
@@ -336,12 +315,11 @@ def start_monitor():
     for room_config in config.monitor_live_rooms:
         if room_config.short_id == -1:
             continue
-        monitor_room = MonitorRoom(room_config)
-        try:
-            asyncio.get_running_loop().create_task(monitor_room.update_room_info())
-        except RuntimeError:
-            asyncio.get_event_loop().create_task(monitor_room.update_room_info())
-            # asyncio.get_event_loop().create_task(test(monitor_room))
+        room_status_poller.add_room(MonitorRoom(room_config))
+    try:
+        asyncio.get_running_loop().create_task(room_status_poller.run())
+    except RuntimeError:
+        asyncio.get_event_loop().create_task(room_status_poller.run())
     logger.info(
         f'正在监听直播间: {", ".join([str(room_config.short_id) for room_config in config.monitor_live_rooms if room_config.short_id != -1])}')
 
@@ -3,7 +3,7 @@ import struct
 from pydantic import BaseModel, validator
 from enum import IntEnum
 from config import get_config
-import aiohttp
+from services.http_client import http_client
 
 config = get_config()
 
@@ -39,6 +39,27 @@ class RoomInfo(BaseModel):
     message: str
 
 
+class RoomStatusInfo(BaseModel):
+    class Data(BaseModel):
+        uid: int
+        room_id: int
+        short_id: int = 0
+        title: str = ''
+        live_status: RoomInfo.Data.LiveStatus
+        live_time: int = 0
+
+    code: int
+    message: str = ''
+    data: dict[int, Data] = {}
+
+    @validator('data', pre=True)
+    def format_data(cls, v):
+        # 没有查询结果时接口返回的是空列表
+        if isinstance(v, list):
+            return {}
+        return v
+
+
 class VideoStreamInfo(BaseModel):
     class Code(IntEnum):
         SUCCESS = 0
@@ -99,12 +120,11 @@ class LiveService:
     async def create_session(self):
         # 创建会话
         if self.session is None:
-            self.session = aiohttp.ClientSession(headers=self.default_headers)
+            self.session = http_client.create_session(headers=self.default_headers)
 
     async def get_room_info(self, room_id: int) -> RoomInfo:
         # 获取房间信息
-        if self.session is None:
-            self.session = aiohttp.ClientSession(headers=self.default_headers)
+        await self.create_session()
         url = 'https://api.live.bilibili.com/room/v1/Room/get_info'
         params = {
             'room_id': room_id
@@ -112,8 +132,19 @@ class LiveService:
         async with self.session.get(url, params=params) as response:
             return RoomInfo.parse_obj(await response.json())
 
+    async def get_room_status_by_uids(self, uids: list[int]) -> dict[int, RoomStatusInfo.Data]:
+        # 批量获取直播间状态
+        await self.create_session()
+        url = 'https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids'
+        async with self.session.post(url, json={'uids': uids}) as response:
+            room_status_info = RoomStatusInfo.parse_obj(await response.json(content_type=None))
+        if room_status_info.code != 0:
+            raise ValueError(f'批量获取直播间状态失败: {room_status_info.message}')
+        return room_status_info.data
+
     async def get_video_stream_info(self, room_id: int, qn: int) -> VideoStreamInfo:
         # 获取视频流信息
+        await self.create_session()
         url = 'https://api.live.bilibili.com/room/v1/Room/playUrl'
         params = {
             'cid': room_id,
@@ -154,4 +185,7 @@ class LiveService:
         code: int
         message: str
         data: Data
-        current_command_count: int = 1
\ No newline at end of file
+        current_command_count: int = 1
+
+
+live_service = LiveService()
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+import websockets
+from loguru import logger
+from pydantic import BaseModel
+
+from config import get_config
+from services.heartbeat import heartbeat_scheduler
+from services.live_service import LiveService
+from services.message_stream import Operation, ProtocolVersion, build_packet, iter_packets, json_loads
+
+
+class MessageStreamConnection:
+    # 弹幕流连接管理：轮换 host_list 中的服务器，失败后按带随机抖动的指数退避重连，
+    # 只在认证被拒绝或所有服务器都连接失败时重新获取密钥
+    danmu_info_url = 'https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo'
+    base_delay = 1.0
+    max_delay = 60.0
+    auth_timeout = 10
+    # 连续这么多次心跳没有回复时关闭连接重连
+    max_missed_heartbeats = 2
+
+    class Stats(BaseModel):
+        # 断线重连统计，gap 为上一次连接断开到重新认证成功的间隔(秒)；
+        # heartbeat_rtt 为最近一次心跳的往返时间(秒)，missed_heartbeats 为当前连续未回复的心跳数
+        connect_count: int = 0
+        reconnect_count: int = 0
+        failed_attempts: int = 0
+        token_refresh_count: int = 0
+        last_gap: float = 0.0
+        max_gap: float = 0.0
+        total_gap: float = 0.0
+        connected_since: Optional[float] = None
+        disconnected_since: Optional[float] = None
+        heartbeat_rtt: Optional[float] = None
+        missed_heartbeats: int = 0
+        total_missed_heartbeats: int = 0
+
+    def __init__(self, room_id: int, get_session: Callable[[], aiohttp.ClientSession],
+                 on_message: Callable[[bytes], Awaitable[None]]):
+        self.room_id = room_id
+        self.get_session = get_session
+        self.on_message = on_message
+        self.danmu_info: Optional[LiveService.MessageKeyResponse] = None
+        self.host_index = 0
+        # failures 为连续失败次数，用于计算退避时间；host_failures 为当前密钥下连续连接失败的次数
+        self.failures = 0
+        self.host_failures = 0
+        self.sequence = 1
+        self.heartbeat_sent_at: Optional[float] = None
+        self.ws: Optional[websockets.WebSocketClientProtocol] = None
+        self.stats = MessageStreamConnection.Stats()
+
+    def is_connected(self) -> bool:
+        # 心跳没有回复的连接视为未连接，由 RoomStatusPoller 照常轮询直播状态
+        return self.ws is not None and self.ws.open and self.stats.connected_since is not None \
+            and self.stats.missed_heartbeats == 0
+
+    async def refresh_token(self):
+        async with self.get_session().get(self.danmu_info_url, params={'id': self.room_id}) as response:
+            self.danmu_info = LiveService.MessageKeyResponse.parse_obj(await response.json())
+        self.host_index = 0
+        self.host_failures = 0
+        self.stats.token_refresh_count += 1
+
+    def next_host(self) -> LiveService.MessageKeyResponse.Data.Host:
+        host_list = self.danmu_info.data.host_list
+        host = host_list[self.host_index % len(host_list)]
+        self.host_index += 1
+        return host
+
+    def get_retry_delay(self) -> float:
+        # 等待时间在退避上限的一半到上限之间随机，避免多个直播间同时重连
+        delay = min(self.max_delay, self.base_delay * 2 ** min(self.failures - 1, 16))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def run(self):
+        # 循环重连，不会递归调用
+        while True:
+            try:
+                if self.danmu_info is None:
+                    await self.refresh_token()
+                await self.connect(self.next_host())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f'直播间{self.room_id}弹幕流连接出错: {e}')
+            finally:
+                heartbeat_scheduler.unregister(self)
+                self.ws = None
+            if self.stats.connected_since is not None:
+                # 已认证的连接断开后从最短的退避时间重新开始
+                self.stats.connected_since = None
+                self.stats.disconnected_since = time.time()
+                self.failures = 0
+                self.host_failures = 0
+            else:
+                self.stats.failed_attempts += 1
+                self.host_failures += 1
+            self.failures += 1
+            if self.danmu_info is not None and self.host_failures >= len(self.danmu_info.data.host_list):
+                # 所有服务器都连接失败，密钥可能已过期
+                self.danmu_info = None
+            delay = self.get_retry_delay()
+            logger.debug(f'直播间{self.room_id}弹幕流已断开，{delay:.1f}秒后重连')
+            await asyncio.sleep(delay)
+
+    async def connect(self, host: LiveService.MessageKeyResponse.Data.Host):
+        self.ws = await websockets.connect(f'wss://{host.host}:{host.wss_port}/sub')
+        await self.send(Operation.AUTHENTICATION, json.dumps({
+            'uid': get_config().mid,
+            'roomid': self.room_id,
+            'protover': ProtocolVersion.BROTLI,
+            'platform': 'web',
+            'type': 2,
+            'key': self.danmu_info.data.token
+        }, separators=(',', ':')).encode('utf-8'))
+        message = await asyncio.wait_for(self.ws.recv(), self.auth_timeout)
+        if not self.is_authenticated(message):
+            logger.warning(f'直播间{self.room_id}弹幕流认证失败，将重新获取密钥')
+            self.danmu_info = None
+            await self.ws.close()
+            return
+        self.on_connected()
+        await self.on_message(message)
+        async for message in self.ws:
+            try:
+                await self.on_message(message)
+            except Exception as e:
+                logger.debug(f'处理消息失败: {e}')
+
+    @staticmethod
+    def is_authenticated(message: bytes) -> bool:
+        for _, operation, body in iter_packets(message):
+            if operation == Operation.AUTHENTICATION_REPLY:
+                return json_loads(body).get('code') == 0
+        return False
+
+    def on_connected(self):
+        now = time.time()
+        self.stats.connect_count += 1
+        self.stats.connected_since = now
+        self.stats.missed_heartbeats = 0
+        self.heartbeat_sent_at = None
+        heartbeat_scheduler.register(self)
+        if self.stats.disconnected_since is None:
+            logger.debug(f'直播间{self.room_id}弹幕流连接成功')
+            return
+        gap = now - self.stats.disconnected_since
+        self.stats.disconnected_since = None
+        self.stats.reconnect_count += 1
+        self.stats.last_gap = gap
+        self.stats.max_gap = max(self.stats.max_gap, gap)
+        self.stats.total_gap += gap
+        logger.info(f'直播间{self.room_id}弹幕流已重连，中断{gap:.1f}秒 '
+                    f'(累计重连{self.stats.reconnect_count}次，共中断{self.stats.total_gap:.1f}秒)')
+
+    async def send_heartbeat(self):
+        # 由 heartbeat_scheduler 定时调用，上一次心跳仍未回复时记为丢失
+        ws = self.ws
+        if ws is None:
+            return
+        if self.heartbeat_sent_at is not None:
+            self.stats.missed_heartbeats += 1
+            self.stats.total_missed_heartbeats += 1
+            if self.stats.missed_heartbeats >= self.max_missed_heartbeats:
+                logger.warning(f'直播间{self.room_id}弹幕流连续{self.stats.missed_heartbeats}次心跳未回复，重新连接')
+                await ws.close()
+                return
+            logger.debug(f'直播间{self.room_id}弹幕流心跳未回复')
+        self.heartbeat_sent_at = time.monotonic()
+        await self.send(Operation.HEARTBEAT, b'')
+
+    def on_heartbeat_reply(self):
+        if self.heartbeat_sent_at is None:
+            return
+        self.stats.heartbeat_rtt = time.monotonic() - self.heartbeat_sent_at
+        self.stats.missed_heartbeats = 0
+        self.heartbeat_sent_at = None
+
+    async def send(self, operation: Operation, body: bytes):
+        # 发送失败时只关闭连接，由 run 负责重连
+        ws = self.ws
+        if ws is None:
+            return
+        packet = build_packet(operation, body, self.sequence)
+        self.sequence += 1
+        try:
+            await ws.send(packet)
+        except Exception as e:
+            logger.error(f'发送消息失败: {e}')
+            await ws.close()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
+from typing import Container, Iterator, Optional
+
+import brotli
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# 弹幕流数据包头: 包长度、头长度、协议版本、操作码、序号
+PACKET_HEADER = struct.Struct('>IHHII')
+PACKET_HEADER_SIZE = PACKET_HEADER.size
+# 命令 JSON 通常以 cmd 开头，可以不解析整个 JSON 先读出命令名
+CMD_PREFIX = b'{"cmd":"'
+CMD_MAX_LENGTH = 64
+# 压缩包体超过该大小时在线程中解压和解析，避免礼物刷屏时阻塞事件循环
+DECOMPRESS_OFFLOAD_SIZE = 16 * 1024
+
+
+class ProtocolVersion(IntEnum):
+    JSON = 0
+    POPULARITY = 1
+    ZLIB = 2
+    BROTLI = 3
+
+
+
+class Operation(IntEnum):
+    HEARTBEAT = 2
+    HEARTBEAT_REPLY = 3
+    COMMAND = 5
+    AUTHENTICATION = 7
+    AUTHENTICATION_REPLY = 8
+
+
+decompress_executor: Optional[ThreadPoolExecutor] = None
+
+
+def json_loads(data):
+    # 安装了 orjson 时使用 orjson，可直接解析 memoryview
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+def iter_packets(data) -> Iterator[tuple[int, int, memoryview]]:
+    # 按偏移依次读取数据中的各个包，返回 (协议版本, 操作码, 包体)，包体为原数据的 memoryview，不复制
+    view = memoryview(data)
+    size = len(view)
+    offset = 0
+    while offset + PACKET_HEADER_SIZE <= size:
+        total_length, header_length, version, operation, _ = PACKET_HEADER.unpack_from(view, offset)
+        if total_length < header_length or offset + total_length > size:
+            break
+        yield version, operation, view[offset + header_length:offset + total_length]
+        offset += total_length
+
+
+def build_packet(operation: int, body: bytes, sequence: int) -> bytes:
+    # 客户端发送的心跳与认证包协议版本为 1
+    version = ProtocolVersion.POPULARITY if operation in (Operation.HEARTBEAT, Operation.AUTHENTICATION) \
+        else ProtocolVersion.JSON
+    return PACKET_HEADER.pack(PACKET_HEADER_SIZE + len(body), PACKET_HEADER_SIZE, version, operation, sequence) + body
+
+
+def peek_cmd(body) -> Optional[str]:
+    # 读取包体开头的命令名，格式不符时返回 None
+    if body[:len(CMD_PREFIX)] != CMD_PREFIX:
+        return None
+    head = bytes(body[len(CMD_PREFIX):len(CMD_PREFIX) + CMD_MAX_LENGTH])
+    end = head.find(b'"')
+    if end < 0:
+        return None
+    return head[:end].decode('utf-8', 'replace')
+
+
+def decode_command(body, commands: Optional[Container[str]] = None) -> Optional[dict]:
+    # 解析单个命令，commands 不为 None 时跳过其中没有的命令，能读出命令名时不解析 JSON
+    if commands is not None:
+        cmd = peek_cmd(body)
+        if cmd is not None and cmd not in commands:
+            return None
+    command = json_loads(body)
+    if commands is not None and command.get('cmd') not in commands:
+        return None
+    return command
+
+
+def decode_packed_commands(data, commands: Optional[Container[str]] = None) -> list[dict]:
+    # 解压后的数据由多个命令包依次拼接而成
+    decoded = []
+    for _, _, body in iter_packets(data):
+        command = decode_command(body, commands)
+        if command is not None:
+            decoded.append(command)
+    return decoded
+
+
+def decompress(version: int, body) -> bytes:
+    if version == ProtocolVersion.BROTLI:
+        return brotli.decompress(bytes(body))
+    return zlib.decompress(body)
+
+
+def decode_compressed_commands(version: int, body, commands: Optional[Container[str]] = None) -> list[dict]:
+    return decode_packed_commands(decompress(version, body), commands)
+
+
+def get_decompress_executor() -> ThreadPoolExecutor:
+    global decompress_executor
+    if decompress_executor is None:
+        decompress_executor = ThreadPoolExecutor(2, thread_name_prefix='message_stream')
+    return decompress_executor
+
+
+async def decode_commands(version: int, body, commands: Optional[Container[str]] = None) -> list[dict]:
+    # 解析一个命令包，压缩包较大时交给线程池处理，zlib 与 brotli 解压时都会释放 GIL
+    if version not in (ProtocolVersion.ZLIB, ProtocolVersion.BROTLI):
+        command = decode_command(body, commands)
+        return [] if command is None else [command]
+    if len(body) < DECOMPRESS_OFFLOAD_SIZE:
+        return decode_compressed_commands(version, body, commands)
+    return await asyncio.get_running_loop().run_in_executor(
+        get_decompress_executor(), decode_compressed_commands, version, body, commands)
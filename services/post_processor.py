@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import itertools
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from enum import IntEnum
+from typing import Callable, Optional
+from loguru import logger
+from pydantic import BaseModel
+
+
+class PostProcessor:
+    # 录制结束后的后处理调度：所有阻塞或 CPU 密集的任务都在有界的线程池/进程池中执行，
+    # 按优先级依次出队，不占用录制所在的事件循环
+    # 上传主要等待网络，使用单独的线程池，不占用合并与生成弹幕的工作槽
+    history_size = 100
+    max_uploads = 2
+
+    class Priority(IntEnum):
+        REMUX = 0
+        DANMAKU = 1
+        RENDER = 2
+        UPLOAD = 3
+
+    class Job(BaseModel):
+        class Status(IntEnum):
+            PENDING = 0
+            RUNNING = 1
+            SUCCESS = 2
+            FAILED = 3
+
+        name: str
+        priority: 'PostProcessor.Priority'
+        status: Status = Status.PENDING
+        submit_time: float = 0
+        start_time: float = 0
+        finish_time: float = 0
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.thread_executor: Optional[ThreadPoolExecutor] = None
+        self.process_executor: Optional[ProcessPoolExecutor] = None
+        self.upload_executor: Optional[ThreadPoolExecutor] = None
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.workers: list[asyncio.Task] = []
+        self.jobs: list[PostProcessor.Job] = []
+        self.counter = itertools.count()
+
+    def start(self):
+        if self.queue is not None:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.workers = [asyncio.get_running_loop().create_task(self.worker()) for _ in range(self.max_workers)]
+
+    def get_executor(self, cpu_bound: bool) -> Executor:
+        # CPU 密集任务使用进程池以避开 GIL，等待子进程或 I/O 的任务使用线程池
+        if cpu_bound:
+            if self.process_executor is None:
+                self.process_executor = ProcessPoolExecutor(self.max_workers)
+            return self.process_executor
+        if self.thread_executor is None:
+            self.thread_executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='post_processor')
+        return self.thread_executor
+
+    def get_upload_executor(self) -> ThreadPoolExecutor:
+        if self.upload_executor is None:
+            self.upload_executor = ThreadPoolExecutor(self.max_uploads, thread_name_prefix='post_processor_upload')
+        return self.upload_executor
+
+    async def submit(self, priority: Priority, name: str, func: Callable, *args, cpu_bound: bool = False, **kwargs):
+        # 提交任务并等待其完成，返回任务结果
+        self.start()
+        job = self.Job(name=name, priority=priority, submit_time=time.time())
+        self.jobs.append(job)
+        if priority == self.Priority.UPLOAD:
+            # 上传不进入队列，直接在上传线程池中执行，同时进行的上传数由 max_uploads 限制
+            return await self.run_job(job, functools.partial(func, *args, **kwargs), self.get_upload_executor())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self.counter), job, functools.partial(func, *args, **kwargs), cpu_bound, future))
+        logger.debug(f'后处理任务已提交: {name}，等待中的任务 {self.queue.qsize()} 个')
+        return await future
+
+    async def worker(self):
+        while True:
+            priority, _, job, func, cpu_bound, future = await self.queue.get()
+            try:
+                result = await self.run_job(job, func, self.get_executor(cpu_bound))
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    async def run_job(self, job: Job, func: Callable, executor: Executor):
+        job.status = self.Job.Status.RUNNING
+        job.start_time = time.time()
+        logger.info(f'开始后处理任务: {job.name}')
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(executor, func)
+        except Exception as e:
+            job.status = self.Job.Status.FAILED
+            logger.error(f'后处理任务失败: {job.name}: {e}')
+            raise
+        else:
+            job.status = self.Job.Status.SUCCESS
+            return result
+        finally:
+            job.finish_time = time.time()
+            logger.info(f'后处理任务结束: {job.name}，耗时 {round(job.finish_time - job.start_time)} 秒')
+            finished_jobs = [j for j in self.jobs if j.status > self.Job.Status.RUNNING]
+            for finished_job in finished_jobs[:-self.history_size]:
+                self.jobs.remove(finished_job)
+
+    def get_jobs(self) -> list[Job]:
+        return list(self.jobs)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.cancel()
+        if self.thread_executor is not None:
+            self.thread_executor.shutdown(wait=False)
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=False)
+        if self.upload_executor is not None:
+            self.upload_executor.shutdown(wait=False)
+
+
+PostProcessor.Job.update_forward_refs()
+post_processor = PostProcessor()
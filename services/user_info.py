@@ -1,5 +1,7 @@
 import asyncio
 import aiohttp
+from typing import Optional
+from services.http_client import http_client
 from config import get_config, save_config, Config
 from pydantic import BaseModel, validator
 
@@ -35,20 +37,28 @@ class UserInfo(BaseModel):
     data: Data
 
 
+session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    global session
+    if session is None or session.closed:
+        config = get_config()
+        cookies = {
+            'SESSDATA': config.SESSDATA,
+            'bili_jct': config.bili_jct,
+            'DedeUserID': config.DedeUserID,
+            'DedeUserID__ckMd5': config.DedeUserID__ckMd5,
+        }
+        session = http_client.create_session(cookies=cookies, headers=default_headers)
+    return session
+
+
 async def get_user_info_by_mid(mid: int) -> UserInfo:
-    config = get_config()
-    cookies = {
-        'SESSDATA': config.SESSDATA,
-        'bili_jct': config.bili_jct,
-        'DedeUserID': config.DedeUserID,
-        'DedeUserID__ckMd5': config.DedeUserID__ckMd5,
-    }
-    session = aiohttp.ClientSession(cookies=cookies, headers=default_headers)
     params = {
         'mid': mid
     }
-    async with session.get('https://api.bilibili.com/x/web-interface/card', params=params) as response:
+    async with get_session().get('https://api.bilibili.com/x/web-interface/card', params=params) as response:
         user_info = UserInfo.parse_obj(await response.json())
-    await session.close()
     return user_info
 
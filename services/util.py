@@ -1,9 +1,17 @@
 from pydantic import BaseModel
 
-import asyncio
+import os
 
-from pathlib import Path
-import random
+
+DANMU_XML_HEAD = '''<?xml version="1.0" encoding="UTF-8"?>
+<i>
+    <chatserver>chat.bilibili.com</chatserver>
+    <chatid>404122228</chatid>
+    <mission>0</mission>
+    <maxlimit>100</maxlimit>
+    <state>0</state>
+    <real_name>0</real_name>
+    <source>k-v</source>'''
 
 
 class Danmu(BaseModel):
@@ -19,39 +27,78 @@ class Danmu(BaseModel):
     level: int = 11
 
     def __str__(self):
-        if '<' in self.content or '>' in self.content or '&' in self.content:
-            return f'<d p="{round(self.appear_time, 5)},{self.danmu_type},{self.font_size},{self.color},{int(self.send_time / 1000)},{self.pool},{self.mid_hash},{self.d_mid},{self.level}"><![CDATA[{self.content}]]></d>'
-        else:
-            return f'<d p="{round(self.appear_time, 5)},{self.danmu_type},{self.font_size},{self.color},{int(self.send_time / 1000)},{self.pool},{self.mid_hash},{self.d_mid},{self.level}">{self.content}</d>'
+        return danmu_to_xml(self)
 
     @classmethod
     def generate_danmu_xml(self, danmus: list['Danmu']):
-        danmu_xml = '''<?xml version="1.0" encoding="UTF-8"?>
-<i>
-    <chatserver>chat.bilibili.com</chatserver>
-    <chatid>404122228</chatid>
-    <mission>0</mission>
-    <maxlimit>100</maxlimit>
-    <state>0</state>
-    <real_name>0</real_name>
-    <source>k-v</source>'''
-        for danmu in danmus:
-            danmu_xml += str(danmu)
-        danmu_xml += '</i>'
-        return danmu_xml
+        return DANMU_XML_HEAD + ''.join(str(danmu) for danmu in danmus) + '</i>'
+
+
+class DanmuRecord:
+    # 弹幕流接收时使用的轻量记录，不做 pydantic 校验，需要时再通过 to_danmu 转换
+    __slots__ = ('appear_time', 'danmu_type', 'font_size', 'color', 'send_time', 'pool', 'mid_hash', 'd_mid',
+                 'content', 'level')
 
+    def __init__(self, appear_time: float, danmu_type: int, font_size: int, color: int, send_time: int,
+                 mid_hash: str, d_mid: int, content: str, pool: int = 0, level: int = 11):
+        self.appear_time = appear_time
+        self.danmu_type = danmu_type
+        self.font_size = font_size
+        self.color = color
+        self.send_time = send_time
+        self.pool = pool
+        self.mid_hash = mid_hash
+        self.d_mid = d_mid
+        self.content = content
+        self.level = level
 
-async def concat_videos(input_files: list[Path], output_file: Path):
-    # 首先，我们使用 ffmpeg 的 `concat` 功能来生成一个临时文件，该文件包含了需要拼接的视频文件的列表
-    temp_file_name = f'temp{str(random.randint(0, 10000))}.txt'
-    with open(temp_file_name, "w") as f:
-        for file in input_files:
-            f.write(f"file '{file.absolute()}'\n")
+    def __str__(self):
+        return danmu_to_xml(self)
+
+    def to_list(self) -> list:
+        return [self.appear_time, self.danmu_type, self.font_size, self.color, self.send_time, self.mid_hash,
+                self.d_mid, self.content, self.pool, self.level]
+
+    @classmethod
+    def from_list(cls, values: list) -> 'DanmuRecord':
+        return cls(*values)
 
-    # 然后，我们调用 ffmpeg 命令行工具，使用该临时文件来拼接视频文件
-    await asyncio.create_subprocess_exec(
-        "ffmpeg", "-f", "concat", "-safe", "0", "-i", Path(temp_file_name).absolute(), "-c", "copy", output_file.absolute(),
-    )
+    @classmethod
+    def from_danmu(cls, danmu: Danmu) -> 'DanmuRecord':
+        return cls(danmu.appear_time, danmu.danmu_type, danmu.font_size, danmu.color, danmu.send_time,
+                   danmu.mid_hash, danmu.d_mid, danmu.content, danmu.pool, danmu.level)
+
+    def to_danmu(self) -> Danmu:
+        return Danmu(appear_time=self.appear_time, danmu_type=self.danmu_type, font_size=self.font_size,
+                     color=self.color, send_time=self.send_time, pool=self.pool, mid_hash=self.mid_hash,
+                     d_mid=self.d_mid, content=self.content, level=self.level)
+
+
+def danmu_to_xml(danmu) -> str:
+    if '<' in danmu.content or '>' in danmu.content or '&' in danmu.content:
+        return f'<d p="{round(danmu.appear_time, 5)},{danmu.danmu_type},{danmu.font_size},{danmu.color},{int(danmu.send_time / 1000)},{danmu.pool},{danmu.mid_hash},{danmu.d_mid},{danmu.level}"><![CDATA[{danmu.content}]]></d>'
+    else:
+        return f'<d p="{round(danmu.appear_time, 5)},{danmu.danmu_type},{danmu.font_size},{danmu.color},{int(danmu.send_time / 1000)},{danmu.pool},{danmu.mid_hash},{danmu.d_mid},{danmu.level}">{danmu.content}</d>'
+
+
+def write_danmu_xml(danmus, path):
+    # 逐条写入 B 站格式的 xml 弹幕文件，不在内存中拼接整个文件
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(DANMU_XML_HEAD)
+        for danmu in danmus:
+            f.write(danmu_to_xml(danmu))
+        f.write('</i>')
 
 
+def get_process_usage(pid: int) -> (float, int):
+    # 读取进程的 CPU 时间(秒)与常驻内存(字节)，非 Linux 系统返回 (0, 0)
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0.0, 0
+    cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu_time, rss_pages * os.sysconf('SC_PAGE_SIZE')
 